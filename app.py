@@ -1,13 +1,42 @@
 import streamlit as st
-import pdfplumber
 import openai
 import pandas as pd
+import numpy as np
 import json
+import html
 import time
 import hashlib
-import re
-from typing import Optional, Dict, Any
-import io
+import atexit
+from typing import Optional, Dict, Any, List, Tuple, Callable
+import os
+import shutil
+import tempfile
+import threading
+import multiprocessing
+import importlib.machinery
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from pdf_extraction import iter_pages, count_pages, extract_table_metrics, current_rss, DEFAULT_WORKERS, PdfSource
+from result_store import ResultStore, file_content_key
+from llm_cache import ResponseCache, SingleFlight, create_response_cache, response_cache_key, DEFAULT_CACHE_PATH
+from metric_schema import ParseStats, load_schema_rows
+from json_repair import MetricStreamParser, repair_json, load_json, salvage_metric_rows
+from rate_limit import RateLimiter, is_retryable, retry_after_seconds, backoff_seconds
+from latency import LatencyTracker, HedgeBudget, hedged_call
+from banned_words import BannedWordMatcher, BannedWordStats
+from pipeline import (
+    OPENAI_MODEL, RELEVANCE_SCAN_PAGES, stage_models, format_page_text, count_page_tokens,
+    select_relevant_pages, join_page_texts, prompt_text_budget, fit_prompt,
+    get_simple_extraction_prompt, get_analysis_prompt, get_refinement_prompt, extraction_format, extraction_prompt,
+    table_metrics_frame, open_result_store, result_key, type_metrics, metrics_frame, rewrite_banned_paragraphs,
+    AMOUNT_COLUMN, UNIT_COLUMN, SCALE_COLUMN, CHANGE_COLUMN
+)
+from prompts import Messages, BANNED_WORDS
+from token_budget import UsageLog, count_message_tokens, split_to_tokens, plan_stage_budget
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # PAGE CONFIGURATION
@@ -28,16 +57,79 @@ except KeyError:
     st.error("OpenAI API key not found. Please add it to Streamlit secrets.")
     st.stop()
 
-client = openai.Client(api_key=OPENAI_API_KEY)
-OPENAI_MODEL = "gpt-4o"
-
-# Define banned words list
-banned_words = "Everest, Matterhorn, levate, juncture, moreover, landscape, utilise, maze, labyrinth, cusp, hurdles, bustling, harnessing, unveiling the power,\
-       realm, depicted, demystify, insurmountable, new era, poised, unravel, entanglement, unprecedented, eerie connection, unliving, \
-       beacon, unleash, delve, enrich, multifaceted, elevate, discover, supercharge, unlock, unleash, tailored, elegant, delve, dive, \
-       ever-evolving, pride, realm, meticulously, grappling, superior, weighing, merely, picture, architect, adventure, journey, embark, \
-       navigate, navigation, navigating, enchanting, world, dazzle, tapestry, in this blog, in this article, dive-in, in today's, right place, \
-       let's get started, imagine this, picture this, consider this, just explore"
+# Point at openai_stub.py (e.g. http://127.0.0.1:8765/v1) or another
+# OpenAI-compatible server to run without the live API
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", st.secrets.get("OPENAI_BASE_URL"))
+
+# Connection pool for the shared OpenAI client. Idle connections stay warm
+# long enough to cover the gap between extraction, analysis and refinement.
+OPENAI_MAX_CONNECTIONS = 20
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 10
+OPENAI_KEEPALIVE_EXPIRY = 120
+OPENAI_CONNECT_TIMEOUT = 10
+OPENAI_READ_TIMEOUT = 120
+# Shared by every session in the process - set these to the account's limits
+OPENAI_RPM_LIMIT = int(os.environ.get("OPENAI_RPM_LIMIT", 500))
+OPENAI_TPM_LIMIT = int(os.environ.get("OPENAI_TPM_LIMIT", 30000))
+# Longest one request in each stage may run before it is abandoned and retried,
+# e.g. OPENAI_DEADLINE_EXTRACTION=30. Streams are held to it per read, so a
+# stream that keeps producing tokens is never cut off.
+STAGE_DEADLINES = {
+    stage: float(os.environ.get(f"OPENAI_DEADLINE_{stage.upper()}", seconds))
+    for stage, seconds in {"extraction": 60, "analysis": 120, "refinement": 120, "rewrite": 60, "default": 120}.items()
+}
+# Blocking calls still running at their stage's observed p95 latency are sent
+# again and the first reply wins, for at most this share of calls. 0 disables.
+HEDGE_MAX_SHARE = float(os.environ.get("OPENAI_HEDGE_MAX_SHARE", 0.05))
+
+@st.cache_resource
+def get_openai_client() -> openai.OpenAI:
+    """OpenAI client shared by every session and rerun, closed when the process exits"""
+    # Limits comes from whichever HTTP library this openai release is built on
+    limits = type(openai.DEFAULT_CONNECTION_LIMITS)(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+    )
+    http_client = openai.DefaultHttpxClient(
+        limits=limits,
+        timeout=openai.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+    )
+    # Retries go through the shared rate limiter instead of the client's own backoff
+    shared_client = openai.Client(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=http_client, max_retries=0)
+    atexit.register(shared_client.close)
+    return shared_client
+
+client = get_openai_client()
+# The analysis card is redrawn at most this often while tokens arrive
+STREAM_RENDER_INTERVAL = 0.1
+
+# Model responses are cached on local disk and shared by every worker process
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "sqlite")
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", DEFAULT_CACHE_PATH)
+RESPONSE_CACHE_MAX_MB = 100
+RESPONSE_CACHE_TTL = 7 * 24 * 3600
+# Whole-report extraction sends page-aligned chunks that each fill one
+# extraction prompt to the model, this many at a time.
+CHUNKED_EXTRACTION_CONCURRENCY = 6
+# Pages scoring below this contain no metric-like content and are not sent
+CHUNKED_MIN_RELEVANCE = 0.05
+# Paragraphs of a generated analysis that use prompts.BANNED_WORDS are
+# rewritten this many at a time
+BANNED_WORD_REWRITE_CONCURRENCY = 4
+
+# Uploads above the threshold are spooled to disk and memory-mapped so that
+# memory use stays flat regardless of document size.
+LARGE_FILE_THRESHOLD_MB = 10
+LARGE_FILE_MAX_MB = 100
+SPOOL_CHUNK_BYTES = 1024 * 1024
+# Spooled uploads live in one temp directory per server process, named with
+# its pid so directories left behind by a killed server are purged on startup
+SPOOL_DIR_PREFIX = "ppc-spool-"
+# Formatted metric cards are kept per distinct metrics frame, so reruns that
+# leave the data unchanged skip formatting. The streaming preview adds one
+# entry per completed row.
+METRIC_DISPLAY_CACHE_ENTRIES = 64
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # MODERN SAAS CSS DESIGN SYSTEM
@@ -509,6 +601,12 @@ st.markdown("""
     /* ═══════════════════════════════════════════════════════════════════════════
        METRIC CARDS - Data Display
        ═══════════════════════════════════════════════════════════════════════════ */
+    .metric-grid {
+        display: grid;
+        grid-template-columns: repeat(3, minmax(0, 1fr));
+        gap: var(--space-4);
+    }
+
     .metric-card {
         background: white;
         border: 1px solid var(--slate-200);
@@ -924,6 +1022,10 @@ st.markdown("""
         .steps-container {
             grid-template-columns: 1fr;
         }
+
+        .metric-grid {
+            grid-template-columns: 1fr;
+        }
     }
 </style>
 """, unsafe_allow_html=True)
@@ -937,8 +1039,8 @@ def validate_uploaded_file(uploaded_file) -> bool:
     if not uploaded_file:
         return False
 
-    if uploaded_file.size > 10 * 1024 * 1024:
-        st.error("File size exceeds 10MB limit. Please upload a smaller file.")
+    if uploaded_file.size > LARGE_FILE_MAX_MB * 1024 * 1024:
+        st.error(f"File size exceeds {LARGE_FILE_MAX_MB}MB limit. Please upload a smaller file.")
         return False
 
     if not uploaded_file.name.lower().endswith('.pdf'):
@@ -947,300 +1049,870 @@ def validate_uploaded_file(uploaded_file) -> bool:
 
     return True
 
-def extract_pdf_text(uploaded_file) -> Optional[str]:
-    """Extract text from all pages of PDF"""
-    if not validate_uploaded_file(uploaded_file):
-        return None
+def is_large_file(uploaded_file) -> bool:
+    """Whether the upload should be processed in bounded-memory mode"""
+    return uploaded_file.size > LARGE_FILE_THRESHOLD_MB * 1024 * 1024
 
+def purge_stale_spool_dirs():
+    """Delete spool directories whose server process is no longer running"""
+    root = tempfile.gettempdir()
+    for name in os.listdir(root):
+        if not name.startswith(SPOOL_DIR_PREFIX):
+            continue
+        try:
+            pid = int(name[len(SPOOL_DIR_PREFIX):].split("-")[0])
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        except (ValueError, OSError):
+            pass
+
+class SpooledFiles:
+    """Spooled upload path of each session, in a temp directory removed when
+    the process exits. Files of sessions that have ended are deleted on the
+    next spool, since Streamlit gives no callback when a session closes."""
+
+    def __init__(self):
+        purge_stale_spool_dirs()
+        self.directory = tempfile.mkdtemp(prefix=f"{SPOOL_DIR_PREFIX}{os.getpid()}-")
+        self._paths = {}
+        self._lock = threading.Lock()
+        atexit.register(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def add(self, session_id: str, path: str):
+        with self._lock:
+            self._paths[session_id] = path
+
+    def remove(self, session_id: str):
+        with self._lock:
+            path = self._paths.pop(session_id, None)
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def remove_ended(self):
+        """Delete the files of sessions no longer connected"""
+        runtime = Runtime.instance() if Runtime.exists() else None
+        if runtime is None:
+            return
+        with self._lock:
+            ended = [session_id for session_id in self._paths if not runtime.is_active_session(session_id)]
+        for session_id in ended:
+            self.remove(session_id)
+
+@st.cache_resource
+def get_spooled_files() -> SpooledFiles:
+    """Spooled uploads of all sessions in this process"""
+    return SpooledFiles()
+
+def remove_spooled_pdf():
+    """Delete the temp file holding the current large upload, if any"""
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        get_spooled_files().remove(ctx.session_id)
+    spooled = st.session_state.get("spooled_pdf")
+    if spooled:
+        try:
+            os.remove(spooled["path"])
+        except OSError:
+            pass
+    st.session_state.spooled_pdf = None
+
+def upload_content_key(uploaded_file) -> str:
+    """content_key of the upload, hashed once per upload rather than on every rerun"""
+    cached = st.session_state.get("upload_key")
+    if cached and cached["file_id"] == uploaded_file.file_id:
+        return cached["key"]
+    key = file_content_key(uploaded_file)
+    st.session_state.upload_key = {"file_id": uploaded_file.file_id, "key": key}
+    return key
+
+def get_pdf_source(uploaded_file) -> PdfSource:
+    """Return the upload as bytes, or for large files as a spooled temp file path
+
+    Large files are copied to disk in chunks once per upload. Extraction then
+    memory-maps that file, and pool workers are handed its path instead of
+    tens of megabytes of pickled bytes.
+    """
+    if not is_large_file(uploaded_file):
+        return uploaded_file.getvalue()
+
+    spooled = st.session_state.get("spooled_pdf")
+    if spooled and spooled["file_id"] == uploaded_file.file_id and os.path.exists(spooled["path"]):
+        return spooled["path"]
+
+    remove_spooled_pdf()
+    spooled_files = get_spooled_files()
+    spooled_files.remove_ended()
+    uploaded_file.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".pdf", dir=spooled_files.directory, delete=False) as f:
+        shutil.copyfileobj(uploaded_file, f, SPOOL_CHUNK_BYTES)
+    uploaded_file.seek(0)
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        spooled_files.add(ctx.session_id, f.name)
+    st.session_state.spooled_pdf = {"file_id": uploaded_file.file_id, "path": f.name}
+    return f.name
+
+# Streamlit runs this script as a __main__ module without a spec, and
+# multiprocessing re-runs such a script in every worker it starts. A spec named
+# __main__ tells workers there is no main module to prepare - they only run
+# pdf_extraction.
+__spec__ = importlib.machinery.ModuleSpec("__main__", None)
+
+@st.cache_resource
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """Process pool shared by all sessions for page extraction"""
+    # Workers are forked from a single-threaded server process with
+    # pdf_extraction already imported, never from this multi-threaded one
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["pdf_extraction"])
+    return ProcessPoolExecutor(max_workers=DEFAULT_WORKERS, mp_context=context)
+
+def budget_filled(pdf_pages: Dict[str, Any], token_budget: Optional[int]) -> bool:
+    """Whether enough pages have been read to fill the prompt from the best of them"""
+    if token_budget is None:
+        return False
+    return pdf_pages["tokens"] >= token_budget and len(pdf_pages["pages"]) >= RELEVANCE_SCAN_PAGES
+
+def read_more_pages(uploaded_file, pdf_pages: Dict[str, Any], token_budget: Optional[int], parallel: bool):
+    """Parse pages not read yet until token_budget tokens are collected from
+    at least RELEVANCE_SCAN_PAGES pages, or the PDF ends"""
+    start = time.perf_counter()
+    pool = get_extraction_pool() if parallel else None
     try:
-        with pdfplumber.open(uploaded_file) as pdf:
-            all_text = ""
-            pages_processed = 0
-
-            for i, page in enumerate(pdf.pages):
-                try:
-                    text = page.extract_text()
-                    if text and text.strip():
-                        all_text += f"\n--- Page {i+1} ---\n{text}\n"
-                        pages_processed += 1
-                except Exception as e:
-                    st.warning(f"Could not extract text from page {i+1}")
-                    continue
-
-            if pages_processed == 0:
-                st.error("No readable text found in the PDF.")
-                return None
+        try:
+            collect_pages(uploaded_file, pdf_pages, token_budget, pool)
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool next time and finish this read
+            # in-process from the first page not collected
+            pool.shutdown(wait=False, cancel_futures=True)
+            get_extraction_pool.clear()
+            collect_pages(uploaded_file, pdf_pages, token_budget, None)
+    finally:
+        pdf_pages["wall_seconds"] += time.perf_counter() - start
+
+def collect_pages(uploaded_file, pdf_pages: Dict[str, Any], token_budget: Optional[int], executor: Optional[Executor]):
+    """Append pages not read yet to pdf_pages until the budget is filled or the PDF ends"""
+    pages = iter_pages(get_pdf_source(uploaded_file), executor, start_page=len(pdf_pages["pages"]))
+    try:
+        for page in pages:
+            if page["error"] is not None:
+                st.warning(f"Could not extract text from page {page['page']}")
+            pdf_pages["pages"].append(page)
+            # Short documents are read in-process even when a pool is given
+            if page["pid"] != os.getpid():
+                pdf_pages["mode"] = "parallel"
+            pdf_pages["tokens"] += count_page_tokens(page)
+            # Pages read by a worker carry the worker's memory, not the app's
+            pdf_pages["peak_rss"] = max(pdf_pages["peak_rss"], current_rss())
+            if page["pid"] != os.getpid():
+                pdf_pages["worker_peak_rss"] = max(pdf_pages["worker_peak_rss"], page["rss"])
+            if budget_filled(pdf_pages, token_budget):
+                break
+        else:
+            pdf_pages["complete"] = True
+    finally:
+        pages.close()
 
-            st.toast(f"Extracted text from {pages_processed} page(s)", icon="✅")
-            return all_text.strip()
+def extract_pdf_text(uploaded_file, parallel: bool = True, token_budget: Optional[int] = None) -> Optional[str]:
+    """Extract text from the PDF, or with token_budget the most metric-dense
+    pages that fit in it
 
-    except Exception as e:
-        st.error(f"Failed to process PDF: {str(e)}")
+    Parsed pages are kept in session state, so asking for more text later
+    (e.g. the full text view) only parses the pages that have not been read yet.
+    """
+    if not validate_uploaded_file(uploaded_file):
         return None
 
-@st.cache_data(ttl=3600)
-def cached_openai_call(prompt_hash: str, prompt: str, model: str = OPENAI_MODEL) -> Optional[str]:
-    """Cached OpenAI API call"""
-    return call_openai_api_with_retry(prompt, model)
+    pdf_pages = st.session_state.pdf_pages
+    if pdf_pages is None or pdf_pages["file_id"] != uploaded_file.file_id:
+        pdf_pages = st.session_state.pdf_pages = {
+            "file_id": uploaded_file.file_id,
+            "page_count": None,
+            "pages": [],
+            "tokens": 0,
+            "complete": False,
+            "mode": "sequential",
+            "wall_seconds": 0.0,
+            "peak_rss": 0,
+            "worker_peak_rss": 0,
+        }
 
-def call_openai_api_with_retry(prompt: str, model: str = OPENAI_MODEL, max_retries: int = 3) -> Optional[str]:
-    """Call OpenAI API with retry logic"""
-    for attempt in range(max_retries):
-        try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are a data extraction assistant specialized in parsing advertising reports."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=4000
-            )
-            return response.choices[0].message.content
+    try:
+        if pdf_pages["page_count"] is None:
+            pdf_pages["page_count"] = count_pages(get_pdf_source(uploaded_file))
 
-        except openai.RateLimitError:
-            if attempt < max_retries - 1:
-                wait_time = (2 ** attempt) + 1
-                st.warning(f"Rate limit reached. Retrying in {wait_time}s...")
-                time.sleep(wait_time)
-                continue
-            st.error("Rate limit exceeded. Please try again later.")
-            return None
+        needs_more = not budget_filled(pdf_pages, token_budget)
+        if needs_more and not pdf_pages["complete"]:
+            read_more_pages(uploaded_file, pdf_pages, token_budget, parallel)
 
-        except openai.APIError as e:
-            if attempt < max_retries - 1:
-                wait_time = 2 ** attempt
-                time.sleep(wait_time)
-                continue
-            st.error(f"API error: {str(e)}")
-            return None
+        pages = pdf_pages["pages"] if token_budget is None else select_relevant_pages(pdf_pages["pages"], token_budget)
+        text = join_page_texts(pages)
 
-        except Exception as e:
-            if attempt < max_retries - 1:
-                wait_time = 2 ** attempt
-                time.sleep(wait_time)
-                continue
-            st.error(f"Unexpected error: {str(e)}")
+        if not text:
+            st.error("No readable text found in the PDF.")
             return None
 
-    return None
+        if needs_more:
+            st.toast(f"Extracted text from {len(pdf_pages['pages'])} of {pdf_pages['page_count']} page(s)", icon="✅")
+        return text
 
-def call_openai_api(prompt: str, model: str = OPENAI_MODEL) -> Optional[str]:
-    """Main OpenAI API call function with caching"""
-    prompt_hash = hashlib.md5(f"{prompt}{model}".encode()).hexdigest()
-    return cached_openai_call(prompt_hash, prompt, model)
+    except Exception as e:
+        st.error(f"Failed to process PDF: {str(e)}")
+        return None
 
-def clean_json_string(json_str: str) -> str:
-    """Comprehensive JSON string cleaning"""
-    if '```json' in json_str:
-        json_str = json_str.split('```json')[1].split('```')[0].strip()
-    elif '```' in json_str:
-        json_str = json_str.split('```')[1].split('```')[0].strip()
+def show_extraction_stats(pdf_pages: Dict[str, Any]):
+    """Show per-page extraction timings"""
+    timings = [
+        {
+            "page": p["page"],
+            "seconds": p["seconds"],
+            "rss_mb": round(p["rss"] / (1024 * 1024), 1),
+            "worker": p["pid"] != os.getpid(),
+            "relevance": round(p["score"], 3),
+            "tokens": p["tokens"],
+            "ok": p["error"] is None,
+        }
+        for p in pdf_pages["pages"]
+    ]
+    page_seconds = sum(t["seconds"] for t in timings)
+    speedup = page_seconds / pdf_pages["wall_seconds"] if pdf_pages["wall_seconds"] else 0
+    memory = f"app peak memory {pdf_pages['peak_rss'] / (1024 * 1024):.0f}MB"
+    if pdf_pages["worker_peak_rss"]:
+        memory += f", worker peak {pdf_pages['worker_peak_rss'] / (1024 * 1024):.0f}MB"
+    st.caption(
+        f"{pdf_pages['mode'].capitalize()} extraction: {len(timings)} of {pdf_pages['page_count']} page(s) "
+        f"in {pdf_pages['wall_seconds']:.2f}s ({page_seconds:.2f}s of page work, {speedup:.1f}x), {memory}"
+    )
+    st.dataframe(pd.DataFrame(timings), use_container_width=True, hide_index=True)
+
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """Response cache shared by all sessions and worker processes"""
+    options = {"max_bytes": RESPONSE_CACHE_MAX_MB * 1024 * 1024, "ttl": RESPONSE_CACHE_TTL}
+    if RESPONSE_CACHE_BACKEND == "sqlite":
+        options["path"] = RESPONSE_CACHE_PATH
+    return create_response_cache(RESPONSE_CACHE_BACKEND, **options)
+
+@st.cache_resource
+def get_single_flight() -> SingleFlight:
+    """Coalesces identical requests in flight across all sessions of this process"""
+    return SingleFlight()
+
+@st.cache_resource
+def get_rate_limiter() -> RateLimiter:
+    """Request and token rate limits shared by all sessions of this process"""
+    return RateLimiter(OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT)
+
+def wait_for_capacity(tokens: int, retry_in: float = 0.0, acquire: bool = True):
+    """Wait out a retry delay, then queue for the shared rate limits unless
+    acquire is False because the caller already holds the capacity.
+
+    Waits are taken in short steps that update a notice with the queue
+    position, so users see progress and a rerun can interrupt them.
+    """
+    notice = None
+
+    def show(message: str):
+        nonlocal notice
+        if notice is None:
+            notice = st.empty()
+        notice.info(message)
+
+    def show_position(position: int, seconds: Optional[float]):
+        if seconds is None:
+            show(f"Waiting for API capacity - position {position} in queue...")
+        else:
+            show(f"Waiting for API capacity - next in queue, about {seconds:.0f}s...")
+
+    deadline = time.monotonic() + retry_in
+    while (remaining := deadline - time.monotonic()) > 0:
+        show(f"Retrying in {remaining:.0f}s...")
+        time.sleep(min(remaining, 1.0))
+
+    if acquire:
+        get_rate_limiter().acquire(tokens, on_wait=show_position)
+    if notice is not None:
+        notice.empty()
+
+@st.cache_resource
+def get_usage_log() -> UsageLog:
+    """Estimated and actual token usage of recent calls in this process"""
+    return UsageLog()
+
+@st.cache_resource
+def get_latency_tracker() -> LatencyTracker:
+    """Recent call latencies per stage in this process"""
+    return LatencyTracker()
+
+@st.cache_resource
+def get_hedge_budget() -> HedgeBudget:
+    """Share of calls allowed a hedged duplicate, shared by all sessions"""
+    return HedgeBudget(HEDGE_MAX_SHARE)
+
+@st.cache_resource
+def get_hedge_pool() -> ThreadPoolExecutor:
+    """Threads that run blocking calls and their hedges"""
+    return ThreadPoolExecutor(max_workers=OPENAI_MAX_CONNECTIONS, thread_name_prefix="openai-call")
+
+def single_flight_call(key: str, call: Callable[[], Any]) -> Any:
+    """Run call once for all sessions asking for key at the same time.
+
+    Waiters update a notice while the identical request is in flight, which
+    also lets a rerun or Stop interrupt them.
+    """
+    notice = None
+
+    def show():
+        nonlocal notice
+        if notice is None:
+            notice = st.empty()
+        notice.info("Waiting for an identical request already in progress...")
 
-    start_idx = json_str.find('[')
-    end_idx = json_str.rfind(']') + 1
+    try:
+        return get_single_flight().do(key, call, on_wait=show)
+    finally:
+        if notice is not None:
+            notice.empty()
 
-    if start_idx != -1 and end_idx > start_idx:
-        json_str = json_str[start_idx:end_idx]
+def stage_deadline(stage: str) -> float:
+    return STAGE_DEADLINES.get(stage, STAGE_DEADLINES["default"])
 
-    json_str = re.sub(r"'([^']*)':", r'"\1":', json_str)
-    json_str = re.sub(r":\s*'([^']*)'", r': "\1"', json_str)
+def cached_openai_call(prompt_hash: str, messages: Messages, model: str = OPENAI_MODEL, stage: str = "default",
+                       response_format: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """Cached OpenAI API call"""
+    cache = get_response_cache()
+    key = response_cache_key(model, stage, prompt_hash)
+    response = cache.get(key)
+    if response is not None:
+        return response
+
+    def call() -> Optional[str]:
+        response = call_openai_api_with_retry(messages, model, stage, response_format=response_format)
+        if response:
+            cache.put(key, response, model=model, stage=stage)
+        return response
+
+    return single_flight_call(key, call)
+
+def call_openai_api_with_retry(messages: Messages, model: str = OPENAI_MODEL, stage: str = "default", max_retries: int = 3,
+                               response_format: Optional[Dict[str, Any]] = None,
+                               capacity_held: bool = False, retry_in: float = 0.0) -> Optional[str]:
+    """Call OpenAI API through the shared rate limiter, retrying transient errors.
+
+    Each attempt is abandoned after the stage's deadline. Once the stage has
+    enough latency samples, an attempt still running at its p95 is hedged
+    with a duplicate request when the hedge budget and rate limits allow.
+    A caller retrying a failed request passes capacity_held, so the first
+    attempt waits retry_in seconds and reuses the capacity that request took.
+    """
+    estimated_tokens = count_message_tokens(messages, model)
+    max_tokens = plan_stage_budget(stage, model)["output_tokens"]
+    options = {"response_format": response_format} if response_format else {}
+    deadline = stage_deadline(stage)
+    # Requests run on pool threads, outside the script's Streamlit context
+    usage_log, latencies, hedges, limiter = get_usage_log(), get_latency_tracker(), get_hedge_budget(), get_rate_limiter()
+
+    def request():
+        start = time.perf_counter()
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0.1,
+            max_tokens=max_tokens,
+            timeout=deadline,
+            **options
+        )
+        return response, time.perf_counter() - start
+
+    def may_hedge() -> bool:
+        # A hedge only uses capacity nobody is queued for
+        return hedges.try_spend(lambda: limiter.try_acquire(estimated_tokens + max_tokens))
 
-    json_str = json_str.replace('+∞%', 'null')
-    json_str = json_str.replace('-∞%', 'null')
-    json_str = json_str.replace('∞%', 'null')
-    json_str = json_str.replace('+∞', 'null')
-    json_str = json_str.replace('-∞', 'null')
-    json_str = json_str.replace('∞', 'null')
+    for attempt in range(max_retries):
+        # The provider counts max_tokens against the token limit up front
+        wait_for_capacity(estimated_tokens + max_tokens, retry_in, acquire=attempt > 0 or not capacity_held)
+        try:
+            hedges.note_call()
+            hedge_after = latencies.hedge_delay(stage) if HEDGE_MAX_SHARE > 0 else None
+            (response, seconds), from_hedge = hedged_call(get_hedge_pool(), request, hedge_after, may_hedge, deadline)
+            if from_hedge:
+                hedges.note_win()
+            # Only the request that answered is logged; the duplicate is counted by the hedge budget
+            usage_log.record(stage, model, estimated_tokens, max_tokens, response.usage, seconds)
+            latencies.observe(stage, seconds)
+            return response.choices[0].message.content
 
-    json_str = json_str.replace('True', 'true').replace('False', 'false').replace('None', 'null')
-    json_str = re.sub(r',(\s*[}\]])', r'\1', json_str)
+        except Exception as e:
+            if not is_retryable(e) or attempt == max_retries - 1:
+                if isinstance(e, (openai.APITimeoutError, TimeoutError)):
+                    st.error(f"The AI service did not respond within {deadline:.0f}s. Please try again.")
+                elif isinstance(e, openai.RateLimitError):
+                    st.error("Rate limit exceeded. Please try again later.")
+                elif isinstance(e, openai.APIError):
+                    st.error(f"API error: {str(e)}")
+                else:
+                    st.error(f"Unexpected error: {str(e)}")
+                return None
 
-    return json_str
+            retry_in = backoff_seconds(attempt, retry_after_seconds(e))
+            if isinstance(e, openai.RateLimitError):
+                # Every session backs off together rather than retrying into the same limit
+                get_rate_limiter().pause(retry_in)
+                retry_in = 0.0
 
-def parse_structured_data(structured_data: str) -> Optional[pd.DataFrame]:
+    return None
+
+def stream_openai_api(prompt_hash: str, messages: Messages, model: str, stage: str, render: Callable[[str, bool], None],
+                      response_format: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """Stream a completion, calling render(text_so_far, done) as it arrives and
+    returning the full text once it completes
+
+    A rerun (e.g. the user pressing stop) interrupts the loop at the next
+    render; the HTTP stream is closed and nothing is cached.
+    """
+    cache = get_response_cache()
+    key = response_cache_key(model, stage, prompt_hash)
+    text = cache.get(key)
+    if text is None:
+        # Waiters for an identical stream in flight get its text once it completes
+        text = single_flight_call(key, lambda: stream_completion(key, messages, model, stage, render, response_format))
+    if text:
+        render(text, True)
+    return text
+
+def stream_completion(key: str, messages: Messages, model: str, stage: str, render: Callable[[str, bool], None],
+                      response_format: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """Stream one completion through render and cache it once it completes"""
+    cache = get_response_cache()
+    estimated_tokens = count_message_tokens(messages, model)
+    max_tokens = plan_stage_budget(stage, model)["output_tokens"]
+    options = {"response_format": response_format} if response_format else {}
+    wait_for_capacity(estimated_tokens + max_tokens)
+    start = time.perf_counter()
+    try:
+        stream = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0.1,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=stage_deadline(stage),
+            **options
+        )
+    except openai.OpenAIError as e:
+        if not is_retryable(e):
+            st.error(f"API error: {str(e)}")
+            return None
+        retry_in = backoff_seconds(0, retry_after_seconds(e))
+        if isinstance(e, openai.RateLimitError):
+            get_rate_limiter().pause(retry_in)
+        # Nothing rendered yet, so fall back to the blocking call and its
+        # retries, handing over the capacity this request already took
+        text = call_openai_api_with_retry(
+            messages, model, stage, response_format=response_format, capacity_held=True, retry_in=retry_in
+        )
+        if text:
+            cache.put(key, text, model=model, stage=stage)
+        return text
+
+    parts = []
+    usage = None
+    last_render = 0.0
+    try:
+        for event in stream:
+            # Usage arrives on a final event that has no choices
+            usage = getattr(event, "usage", None) or usage
+            if not event.choices or not event.choices[0].delta.content:
+                continue
+            parts.append(event.choices[0].delta.content)
+            if time.monotonic() - last_render >= STREAM_RENDER_INTERVAL:
+                render("".join(parts), False)
+                last_render = time.monotonic()
+    except Exception as e:
+        # Includes a read that stalled past the stage deadline
+        st.error(f"API error: {str(e)}")
+        return None
+    finally:
+        stream.close()
+
+    text = "".join(parts)
+    seconds = time.perf_counter() - start
+    get_usage_log().record(stage, model, estimated_tokens, max_tokens, usage, seconds)
+    get_latency_tracker().observe(stage, seconds)
+    if not text:
+        return None
+
+    cache.put(key, text, model=model, stage=stage)
+    return text
+
+def call_openai_api(messages: Messages, model: Optional[str] = None, stream_to=None, stage: str = "default",
+                    response_format: Optional[Dict[str, Any]] = None,
+                    on_text: Optional[Callable[[str], None]] = None) -> Optional[str]:
+    """Main OpenAI API call function with caching
+
+    stage ("extraction", "analysis", "refinement") is part of the cache key
+    and picks the model from STAGE_MODELS unless one is given.
+    Pass an st.empty() placeholder as stream_to to render tokens as they arrive,
+    or on_text to be called with the text so far instead.
+    response_format constrains the reply (e.g. to a JSON schema).
+    """
+    model = model or stage_models(stage)[0]
+    format_key = json.dumps(response_format, sort_keys=True) if response_format else ""
+    prompt_hash = hashlib.md5(f"{json.dumps(messages, ensure_ascii=False)}{model}{format_key}".encode()).hexdigest()
+    if stream_to is not None:
+        def render(text: str, done: bool):
+            stream_to.markdown(text if done else text + " ▌")
+        return stream_openai_api(prompt_hash, messages, model, stage, render, response_format)
+    if on_text is not None:
+        return stream_openai_api(prompt_hash, messages, model, stage, lambda text, done: on_text(text), response_format)
+    return cached_openai_call(prompt_hash, messages, model, stage, response_format)
+
+def parse_structured_data(structured_data: str, quiet: bool = False) -> Optional[pd.DataFrame]:
     """Enhanced parsing function with multiple fallback strategies"""
     if not structured_data or not structured_data.strip():
-        st.error("No data received from AI analysis.")
+        if not quiet:
+            st.error("No data received from AI analysis.")
         return None
 
-    try:
-        cleaned_json = clean_json_string(structured_data)
-        data = json.loads(cleaned_json)
-
-        if isinstance(data, list) and len(data) > 0:
-            df = pd.DataFrame(data)
+    data = load_json(repair_json(structured_data))
+    if isinstance(data, dict):
+        # A schema-shaped reply, {"metrics": [...]}
+        data = data.get("metrics")
+    if isinstance(data, list) and len(data) > 0 and all(isinstance(row, dict) for row in data):
+        df = type_metrics(pd.DataFrame(data))
+        if not quiet:
             st.toast(f"Parsed {len(data)} metrics successfully", icon="✅")
-            return df
+        return df
 
-    except json.JSONDecodeError:
-        pass
-
-    try:
-        metrics_data = []
-        object_pattern = r'\{\s*"Metric"\s*:\s*"([^"]+)"\s*,\s*"Value"\s*:\s*"([^"]+)"\s*,\s*"Change \(%\)"\s*:\s*([^,}]+)\s*,\s*"Period"\s*:\s*"([^"]+)"\s*\}'
-        matches = re.findall(object_pattern, structured_data, re.DOTALL)
-
-        for match in matches:
-            metric, value, change, period = match
-            change = change.strip().rstrip(',')
-            if change in ['null', 'None', '']:
-                change = None
-            else:
-                try:
-                    change = float(change)
-                except ValueError:
-                    change = None
-
-            metrics_data.append({
-                'Metric': metric.strip(),
-                'Value': value.strip(),
-                'Change (%)': change,
-                'Period': period.strip()
-            })
-
-        if metrics_data:
-            df = pd.DataFrame(metrics_data)
+    # Keep whatever rows were complete, e.g. in a reply cut off at max_tokens
+    metrics_data = salvage_metric_rows(structured_data)
+    if metrics_data:
+        df = type_metrics(pd.DataFrame(metrics_data))
+        if not quiet:
             st.toast(f"Extracted {len(metrics_data)} metrics", icon="✅")
-            return df
+        return df
 
-    except Exception:
-        pass
+    if quiet:
+        return None
 
     st.error("Failed to parse metrics data.")
     with st.expander("Debug: Raw AI Response"):
         st.code(structured_data, language="json")
     return None
 
-def get_safer_extraction_prompt(raw_text: str) -> str:
-    """Generate extraction prompt"""
-    return f"""
-Extract key performance metrics from this Google Ads report and return as valid JSON.
-
-CRITICAL JSON RULES:
-1. Use ONLY double quotes, never single quotes
-2. Escape any quotes in string values with backslash
-3. Use null (not "null") for missing values
-4. Keep numbers as numbers, not strings for Change (%)
-5. Remove % symbol from Change (%) values - just use the number
-6. Be extra careful with product names containing quotes or special characters
-
-Return EXACTLY this format:
-[
-  {{"Metric": "Clicks", "Value": "2025", "Change (%)": 11.3, "Period": "Month on Month"}},
-  {{"Metric": "Impressions", "Value": "173.25K", "Change (%)": 33.9, "Period": "Month on Month"}},
-  {{"Metric": "Cost", "Value": "£1564.51", "Change (%)": 22.4, "Period": "Month on Month"}},
-  {{"Metric": "Conversions", "Value": "8.75", "Change (%)": -66.6, "Period": "Month on Month"}},
-  {{"Metric": "CTR", "Value": "1.17%", "Change (%)": -16.9, "Period": "Month on Month"}},
-  {{"Metric": "Average CPC", "Value": "£0.77", "Change (%)": 10.0, "Period": "Month on Month"}},
-  {{"Metric": "Cost per Conversion", "Value": "£178.73", "Change (%)": 266.8, "Period": "Month on Month"}},
-  {{"Metric": "Conversion Rate", "Value": "0.2%", "Change (%)": -81.9, "Period": "Month on Month"}}
-]
-
-Text to analyze:
-{raw_text[:3000]}...
-
-JSON only:"""
-
-def get_change_class(change_str):
-    """Return CSS class based on change direction"""
-    if not change_str or str(change_str).lower() in ['null', 'none', '']:
-        return 'change-neutral'
-
-    try:
-        clean_str = str(change_str).replace('%', '').replace('+', '').strip()
-        num_value = float(clean_str)
-
-        if num_value > 0:
-            return 'change-positive'
-        elif num_value < 0:
-            return 'change-negative'
-        else:
-            return 'change-neutral'
-
-    except ValueError:
-        change_clean = str(change_str).strip()
-        if change_clean.startswith('+'):
-            return 'change-positive'
-        elif change_clean.startswith('-'):
-            return 'change-negative'
-        else:
-            return 'change-neutral'
-
-def get_change_icon(change_str):
-    """Return appropriate icon for change"""
-    if not change_str or str(change_str).lower() in ['null', 'none', '']:
-        return '—'
-
-    try:
-        clean_str = str(change_str).replace('%', '').replace('+', '').strip()
-        num_value = float(clean_str)
-
-        if num_value > 0:
-            return '↑'
-        elif num_value < 0:
-            return '↓'
-        else:
-            return '—'
-
-    except ValueError:
-        return '—'
-
-def format_metric_value(value):
-    """Format metric values"""
-    if not value or pd.isna(value):
-        return str(value)
-
-    value_str = str(value).strip()
-
-    if '£' in value_str or '%' in value_str:
-        return value_str
-
-    clean_value = value_str.replace(',', '')
-
+@st.cache_resource
+def get_parse_stats() -> ParseStats:
+    """How often extraction needed the repair pipeline or a second call, for this process"""
+    return ParseStats()
+
+def parse_extraction(structured_data: Optional[str], schema: bool, quiet: bool = False) -> Optional[pd.DataFrame]:
+    """Parse an extraction response, validating it against the schema in one
+    pass when it was requested with one and only repairing it otherwise"""
+    stats = get_parse_stats()
+    if schema:
+        rows = load_schema_rows(structured_data)
+        if rows is not None:
+            stats.count("schema_valid")
+            if not quiet:
+                st.toast(f"Parsed {len(rows)} metrics successfully", icon="✅")
+            return metrics_frame(rows)
+
+    df = parse_structured_data(structured_data, quiet)
+    stats.count("repaired" if df is not None else "failed")
+    return df
+
+def call_extraction(messages: Messages, schema: bool, quiet: bool = False, preview=None) -> Tuple[Optional[str], Optional[pd.DataFrame]]:
+    """Run an extraction prompt on the routed model, re-asking the fallback
+    model when no metrics can be parsed from its output.
+
+    Pass an st.empty() placeholder as preview to stream the response and
+    show metric cards there as they arrive; it is cleared once done.
+    Returns the last response and the metrics parsed from it.
+    """
+    models = stage_models("extraction")
+    response, df = None, None
+    for model in models:
+        last = model == models[-1]
+        on_text = metric_card_preview(preview) if preview is not None else None
+        response = call_openai_api(
+            messages, model=model, stage="extraction", response_format=extraction_format(schema), on_text=on_text
+        )
+        df = parse_extraction(response, schema, quiet=quiet or not last) if response else None
+        get_usage_log().record_attempt("extraction", model)
+        if df is not None and not df.empty:
+            break
+        if not last:
+            get_usage_log().record_fallback("extraction", model, models[-1])
+    if preview is not None:
+        preview.empty()
+    return response, df
+
+def extract_table_data(uploaded_file, show_debug: bool = False) -> Optional[pd.DataFrame]:
+    """Read metrics from the PDF's tables, returning None when the result is low-confidence"""
     try:
-        num_value = float(clean_value)
+        rows, confidence = extract_table_metrics(get_pdf_source(uploaded_file))
+    except Exception:
+        return None
 
-        if ',' in value_str and num_value > 100:
-            return f"£{value_str}"
+    if show_debug:
+        st.caption(f"Table extraction: {len(rows)} row(s), confidence {confidence:.0%}")
 
-        if 0 < num_value < 5 and '.' in clean_value:
-            return f"{value_str}%"
+    df = table_metrics_frame(rows, confidence)
+    if df is None:
+        return None
 
-    except ValueError:
-        pass
+    st.toast(f"Read {len(df)} metrics from report tables", icon="✅")
+    return df
+
+def split_page_chunks(pages: List[Dict[str, Any]], token_budget: int) -> List[str]:
+    """Group consecutive pages into chunks of at most token_budget tokens.
+
+    Pages are never split across chunks unless a single page is longer than
+    the budget on its own, in which case it is cut into budget-sized pieces.
+    """
+    chunks, current, current_tokens = [], "", 0
+    for page in pages:
+        text = format_page_text(page)
+        if not text:
+            continue
+        if current and current_tokens + page["tokens"] > token_budget:
+            chunks.append(current)
+            current, current_tokens = "", 0
+        if page["tokens"] > token_budget:
+            chunks.extend(split_to_tokens(text, token_budget, OPENAI_MODEL))
+            continue
+        current += text
+        current_tokens += page["tokens"]
+    if current:
+        chunks.append(current)
+    return chunks
+
+def merge_metric_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate per-chunk metrics, dropping rows repeated across chunks"""
+    merged = pd.concat(frames, ignore_index=True)
+    keys = pd.DataFrame({
+        "metric": merged["Metric"].astype(str).str.strip().str.lower(),
+        # Compared as numbers, so "1,564.5" and "1564.50" match
+        "amount": merged[AMOUNT_COLUMN].where(merged[AMOUNT_COLUMN].notna(), merged["Value"].astype(str).str.strip()),
+        "unit": merged[UNIT_COLUMN].astype(str),
+        "period": merged["Period"].astype(str).str.strip().str.lower(),
+    })
+    return merged[~keys.duplicated()].reset_index(drop=True)
+
+def call_chunked_extraction(pages: List[Dict[str, Any]], schema: bool = True) -> Optional[pd.DataFrame]:
+    """Run the extraction prompt over the whole report and merge the results.
+
+    Map: pages with metric-like content are grouped into page-aligned chunks
+    and each chunk is sent to the model, CHUNKED_EXTRACTION_CONCURRENCY at a time.
+    Reduce: the chunk responses are parsed, merged and de-duplicated.
+    """
+    relevant = [page for page in pages if page["score"] >= CHUNKED_MIN_RELEVANCE]
+    chunks = split_page_chunks(relevant, prompt_text_budget(extraction_prompt(schema), "extraction"))
+    if not chunks:
+        return None
 
-    return value_str
+    st.write(f"Extracting metrics from {len(chunks)} section(s)...")
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(
+        max_workers=CHUNKED_EXTRACTION_CONCURRENCY,
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)
+    ) as executor:
+        results = list(executor.map(
+            lambda chunk: call_extraction(fit_prompt(extraction_prompt(schema), chunk, "extraction"), schema, quiet=True),
+            chunks
+        ))
+
+    frames = [frame for _, frame in results if frame is not None and not frame.empty]
+    if not frames:
+        return None
 
-def format_change_value(change):
-    """Format change values"""
-    if not change or pd.isna(change) or str(change).lower() in ['null', 'none', '']:
-        return ''
+    return merge_metric_frames(frames)
 
-    change_str = str(change).strip()
+@st.cache_resource
+def get_result_store() -> ResultStore:
+    """Result store shared by all sessions"""
+    return open_result_store()
 
-    if not change_str:
-        return ''
+def load_saved_results(report_key: str) -> bool:
+    """Restore metrics and analysis for a report seen before"""
+    saved = get_result_store().get(report_key)
+    if not saved or saved.get("metrics") is None or saved["metrics"].empty:
+        return False
 
-    if '%' in change_str:
-        number_part = change_str.replace('%', '').strip()
-    else:
-        number_part = change_str
+    # Stored frames are re-typed, so entries saved before a typed column was
+    # added still render
+    st.session_state.extracted_data = type_metrics(saved["metrics"])
+    st.session_state.analysis_history = [saved["analysis"]] if saved.get("analysis") else []
+    st.toast("Loaded saved results for this report", icon="✅")
+    return True
 
+def save_results(report_key: str, show_debug: bool = False, **results):
+    """Save results for a report, never failing the main flow"""
     try:
-        num_value = float(number_part)
-
-        if num_value > 0:
-            return f"+{abs(num_value):.1f}%"
-        elif num_value < 0:
-            return f"-{abs(num_value):.1f}%"
-        else:
-            return "0%"
+        get_result_store().put(report_key, **results)
+    except OSError as e:
+        if show_debug:
+            st.caption(f"Results not saved: {e}")
+
+def frame_content_hash(df: pd.DataFrame) -> str:
+    """Hash of a frame's values and index"""
+    # Object columns can hold unhashable cells, such as a list from a quirky
+    # reply, so they are hashed by repr - which also keeps 1.0 and "1.0" apart
+    objects = df.columns[df.dtypes == object]
+    if len(objects):
+        df = df.assign(**{column: df[column].map(repr) for column in objects})
+    return hashlib.md5(pd.util.hash_pandas_object(df, index=True).values.tobytes()).hexdigest()
+
+@st.cache_data(max_entries=METRIC_DISPLAY_CACHE_ENTRIES, show_spinner=False)
+def metric_display_columns(content_hash: str, _df: pd.DataFrame) -> pd.DataFrame:
+    """Card text for every metric, formatted in one vectorized pass and cached
+    by content_hash, the frame_content_hash of _df"""
+    blank = pd.Series("", index=_df.index, dtype=object)
+    value = _df.get("Value", blank).astype("string").str.strip().fillna("")
+    amount, change = _df[AMOUNT_COLUMN], _df[CHANGE_COLUMN]
+
+    # Bare numbers only: values with a unit or scale suffix are shown as written
+    plain = amount.notna() & _df[UNIT_COLUMN].isna() & _df[SCALE_COLUMN].isna()
+    currency = plain & value.str.contains(",", regex=False) & (amount > 100)
+    percent = plain & ~currency & value.str.contains(".", regex=False) & (amount > 0) & (amount < 5)
+    formatted_value = value.mask(currency, "£" + value).mask(percent, value + "%")
+
+    rising, falling = (change > 0).to_numpy(), (change < 0).to_numpy()
+    magnitude = np.char.mod("%.1f%%", change.abs().fillna(0).to_numpy())
+    formatted_change = np.where(
+        rising, np.char.add("+", magnitude),
+        np.where(falling, np.char.add("-", magnitude), np.where((change == 0).to_numpy(), "0%", ""))
+    )
 
-    except ValueError:
-        if '%' not in change_str:
-            return f"{change_str}%"
-        return change_str
+    return pd.DataFrame({
+        "Metric": _df.get("Metric", blank),
+        "Period": _df.get("Period", blank),
+        "value": formatted_value,
+        "change": formatted_change,
+        "change_class": np.select([rising, falling], ["change-positive", "change-negative"], "change-neutral"),
+        "change_icon": np.select([rising, falling], ["↑", "↓"], "—"),
+    }, index=_df.index)
+
+def metric_display_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Formatted card text for df, reusing the cached result for identical data"""
+    return metric_display_columns(frame_content_hash(df), df)
+
+@st.cache_data(max_entries=METRIC_DISPLAY_CACHE_ENTRIES, show_spinner=False)
+def metric_grid_html(content_hash: str, _df: pd.DataFrame) -> Dict[str, str]:
+    """HTML for each period's title and card grid, cached by content_hash,
+    the frame_content_hash of _df"""
+    display = metric_display_columns(content_hash, _df)
+    # One bad metric name must not break the markup of a whole period
+    label = display["Metric"].astype("string").fillna("").map(html.escape)
+    value = display["value"].map(html.escape)
+    change = ('<span class="metric-change ' + display["change_class"] + '">'
+              + display["change_icon"] + " " + display["change"] + "</span>").where(display["change"] != "", "")
+    cards = ('<div class="metric-card"><div class="metric-label">' + label
+             + '</div><div class="metric-period">' + display["Period"].astype("string").fillna("")
+             + '</div><div class="metric-value">' + value + "</div>" + change + "</div>")
+
+    grids = {}
+    for period in ("Month on Month", "Year on Year"):
+        period_cards = cards[display["Period"] == period]
+        if not period_cards.empty:
+            grids[period] = (f'<p class="period-title">{period}</p>\n'
+                             f'<div class="metric-grid">\n' + "\n".join(period_cards) + "\n</div>")
+    return grids
+
+def render_metric_grid(df: pd.DataFrame):
+    """Render metric cards three to a row, grouped by period, one block per period"""
+    for grid in metric_grid_html(frame_content_hash(df), df).values():
+        st.markdown(grid, unsafe_allow_html=True)
+
+def metric_card_preview(placeholder) -> Callable[[str], None]:
+    """on_text callback that renders metric cards into placeholder as each
+    row of a streamed extraction response completes"""
+    parser = MetricStreamParser()
+    fed = 0
+
+    def on_text(text: str):
+        nonlocal fed
+        if parser.feed(text[fed:]):
+            with placeholder.container():
+                render_metric_grid(metrics_frame(parser.rows))
+        fed = len(text)
+
+    return on_text
+
+def analysis_card_header(version: int) -> str:
+    """Opening HTML of an analysis card"""
+    return f"""<div class="analysis-card">
+<div class="analysis-header">
+<div class="analysis-header-left">
+<div class="analysis-badge">
+<svg viewBox="0 0 24 24"><polygon points="12 2 15.09 8.26 22 9.27 17 14.14 18.18 21.02 12 17.77 5.82 21.02 7 14.14 2 9.27 8.91 8.26 12 2"/></svg>
+</div>
+<div>
+<h3 class="analysis-title">Analysis</h3>
+<span class="analysis-version">Version {version}</span>
+</div>
+</div>
+</div>
+<div class="analysis-content">"""
+
+def generate_analysis(prompt: Messages, version: int, stream: bool) -> Optional[str]:
+    """Generate an analysis, streaming it into a temporary card when enabled
+
+    The temporary card is cleared once generation finishes - the history loop
+    renders the stored result.
+    """
+    st.session_state.generation_cancelled = False
+    stage = "analysis" if version == 1 else "refinement"
+    if not stream:
+        with st.spinner("Generating analysis..." if version == 1 else "Refining..."):
+            result = call_openai_api(prompt, stage=stage)
+        return remove_banned_words(result) if result else None
+
+    card = st.empty()
+    with card.container():
+        st.button("Stop generating", key=f"stop_generation_{version}", on_click=stop_generation)
+        st.markdown(analysis_card_header(version), unsafe_allow_html=True)
+        result = call_openai_api(prompt, stream_to=st.empty(), stage=stage)
+        st.markdown("</div></div>", unsafe_allow_html=True)
+        if result:
+            result = remove_banned_words(result)
+    card.empty()
+    return result
+
+@st.cache_resource
+def get_banned_word_matcher() -> BannedWordMatcher:
+    """Matcher for prompts.BANNED_WORDS, built once per process"""
+    return BannedWordMatcher(BANNED_WORDS)
+
+@st.cache_resource
+def get_banned_word_stats() -> BannedWordStats:
+    """Banned word hits and paragraph rewrites, for this process"""
+    return BannedWordStats()
+
+def remove_banned_words(analysis: str) -> str:
+    """Rewrite only the paragraphs of analysis that use banned words"""
+    ctx = get_script_run_ctx()
+
+    def rewrite(prompts: Dict[Any, Messages]) -> Dict[Any, Optional[str]]:
+        with st.spinner(f"Rewording {len(prompts)} paragraph(s)..."), ThreadPoolExecutor(
+            max_workers=BANNED_WORD_REWRITE_CONCURRENCY,
+            initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)
+        ) as executor:
+            replies = executor.map(lambda messages: call_openai_api(messages, stage="rewrite"), prompts.values())
+            return dict(zip(prompts, replies))
+
+    return rewrite_banned_paragraphs(
+        {"analysis": analysis}, get_banned_word_matcher(), rewrite, get_banned_word_stats()
+    )["analysis"]
+
+def stop_generation():
+    """Cancel the analysis currently streaming"""
+    st.session_state.generation_cancelled = True
 
 def get_clipboard_text(df: pd.DataFrame, analysis: str) -> str:
     """Create clipboard-friendly text version of the report"""
@@ -1252,10 +1924,11 @@ def get_clipboard_text(df: pd.DataFrame, analysis: str) -> str:
         clipboard_text += "KEY PERFORMANCE METRICS\n"
         clipboard_text += "-" * 30 + "\n\n"
 
-        for _, row in df.iterrows():
+        changes = metric_display_frame(df)["change"]
+        for row, change in zip(df.to_dict("records"), changes):
             clipboard_text += f"• {row.get('Metric', '')}: {row.get('Value', '')}"
-            if row.get('Change (%)', ''):
-                clipboard_text += f" ({row.get('Change (%)', '')})"
+            if change:
+                clipboard_text += f" ({change})"
             clipboard_text += f" [{row.get('Period', '')}]\n"
 
         clipboard_text += "\n"
@@ -1275,6 +1948,14 @@ if 'extracted_data' not in st.session_state:
     st.session_state.extracted_data = None
 if 'analysis_history' not in st.session_state:
     st.session_state.analysis_history = []
+if 'pdf_pages' not in st.session_state:
+    st.session_state.pdf_pages = None
+if 'spooled_pdf' not in st.session_state:
+    st.session_state.spooled_pdf = None
+if 'upload_key' not in st.session_state:
+    st.session_state.upload_key = None
+if 'generation_cancelled' not in st.session_state:
+    st.session_state.generation_cancelled = False
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # HEADER
@@ -1297,8 +1978,18 @@ st.markdown("""
 # ═══════════════════════════════════════════════════════════════════════════════
 def reset_analysis_state():
     """Reset analysis state when file changes"""
+    remove_spooled_pdf()
+    st.session_state.extracted_data = None
+    st.session_state.analysis_history = []
+    st.session_state.pdf_pages = None
+    st.session_state.generation_cancelled = False
+
+def reset_extraction_results():
+    """Reset metrics and analysis when the extraction mode changes, so the
+    report is read again in the new mode or loaded from its results"""
     st.session_state.extracted_data = None
     st.session_state.analysis_history = []
+    st.session_state.generation_cancelled = False
 
 with st.sidebar:
     st.markdown("""<div class="sidebar-section">
@@ -1329,6 +2020,54 @@ Settings
 </div>""", unsafe_allow_html=True)
 
     debug_mode = st.checkbox("Debug mode", value=False, help="Show detailed processing information")
+    parallel_extraction = st.checkbox("Parallel extraction", value=True, help="Extract PDF pages across multiple processes")
+    stream_responses = st.checkbox("Stream responses", value=True, help="Show metrics and analysis as they are written")
+    chunked_extraction = st.checkbox("Whole-report extraction", value=False, help="Extract metrics from every page of long, multi-campaign reports", on_change=reset_extraction_results)
+    schema_extraction = st.checkbox("Schema-enforced extraction", value=True, help="Have the model return metrics that match a JSON schema", on_change=reset_extraction_results)
+
+    if debug_mode:
+        cache_stats = get_response_cache().stats()
+        st.caption(
+            f"LLM cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']} entries ({cache_stats['bytes'] / (1024 * 1024):.1f}MB)"
+        )
+        flight_stats = get_single_flight().stats()
+        st.caption(f"In-flight requests: {flight_stats['calls']} sent, {flight_stats['coalesced']} coalesced")
+        limiter_stats = get_rate_limiter().stats()
+        st.caption(
+            f"Rate limiter: {limiter_stats['granted']} granted, {limiter_stats['queued']} queued, "
+            f"{limiter_stats['waiting']} waiting, {limiter_stats['pauses']} pause(s)"
+        )
+        parse_stats = get_parse_stats().snapshot()
+        st.caption(
+            f"Extraction parsing: {parse_stats['schema_valid']} schema-valid, {parse_stats['repaired']} repaired, "
+            f"{parse_stats['failed']} failed, {parse_stats['reasks']} re-asks"
+        )
+        banned_stats = get_banned_word_stats().snapshot()
+        rewrite_p95 = banned_stats["p95_rewrite_seconds"]
+        st.caption(
+            f"Banned words: {banned_stats['flagged']} of {banned_stats['scanned']} analyses flagged, "
+            f"{banned_stats['paragraphs_rewritten']} paragraph(s) rewritten, {banned_stats['left_in']} left in"
+            + (f", p95 rewrite {rewrite_p95}s" if rewrite_p95 is not None else "")
+        )
+        if banned_stats["hits"]:
+            with st.expander("Banned word hits"):
+                st.dataframe(
+                    pd.DataFrame(list(banned_stats["hits"].items()), columns=["word", "hits"]),
+                    use_container_width=True, hide_index=True
+                )
+        hedge_stats = get_hedge_budget().stats()
+        st.caption(
+            f"Hedged requests: {hedge_stats['hedges']} of {hedge_stats['calls']} calls, "
+            f"{hedge_stats['wins']} won (cap {HEDGE_MAX_SHARE:.0%})"
+        )
+        usage_records = get_usage_log().records()
+        if usage_records:
+            with st.expander("Token usage"):
+                st.dataframe(pd.DataFrame(usage_records[::-1]), use_container_width=True, hide_index=True)
+            with st.expander("Stage telemetry"):
+                st.dataframe(pd.DataFrame(get_usage_log().summary()), use_container_width=True, hide_index=True)
+                st.dataframe(pd.DataFrame(get_latency_tracker().summary()), use_container_width=True, hide_index=True)
 
     st.markdown("---")
 
@@ -1352,7 +2091,7 @@ Settings
 <div class="sidebar-help-title">Requirements</div>
 <div class="sidebar-help-text">
 • PDF with readable text<br>
-• Maximum file size: 10MB<br>
+• Maximum file size: 100MB<br>
 • Multi-page reports supported
 </div>
 </div>""", unsafe_allow_html=True)
@@ -1361,47 +2100,68 @@ Settings
 # MAIN APPLICATION
 # ═══════════════════════════════════════════════════════════════════════════════
 if uploaded_file:
+    report_key = result_key(upload_content_key(uploaded_file), chunked=chunked_extraction, schema=schema_extraction)
+
+    if st.session_state.extracted_data is None:
+        load_saved_results(report_key)
+
     if st.session_state.extracted_data is None:
         with st.status("Processing your report...", expanded=True) as status:
             st.write("Extracting text from PDF...")
-            raw_text = extract_pdf_text(uploaded_file)
+            raw_text = extract_pdf_text(
+                uploaded_file,
+                parallel=parallel_extraction,
+                token_budget=prompt_text_budget(extraction_prompt(schema_extraction), "extraction")
+            )
 
             if raw_text:
                 if st.checkbox("Show extracted text"):
-                    st.text_area("Raw text", raw_text, height=200, label_visibility="collapsed")
-
-                st.write("Analysing with AI...")
-                extraction_prompt = get_safer_extraction_prompt(raw_text)
-                structured_data = call_openai_api(extraction_prompt)
+                    full_text = extract_pdf_text(uploaded_file, parallel=parallel_extraction)
+                    st.text_area("Raw text", full_text, height=200, label_visibility="collapsed")
 
-                if structured_data:
-                    if debug_mode:
-                        if st.checkbox("Show AI Response Debug"):
-                            st.code(structured_data, language="json")
+                if debug_mode:
+                    show_extraction_stats(st.session_state.pdf_pages)
 
-                    st.write("Parsing metrics...")
-                    df = parse_structured_data(structured_data)
+                st.write("Reading metric tables...")
+                table_df = extract_table_data(uploaded_file, show_debug=debug_mode)
 
-                    if df is not None and not df.empty:
-                        st.session_state.extracted_data = df
-                        status.update(label="Analysis complete", state="complete", expanded=False)
+                if table_df is not None:
+                    st.session_state.extracted_data = table_df
+                    save_results(report_key, debug_mode, raw_text=raw_text, metrics=table_df)
+                    status.update(label="Analysis complete", state="complete", expanded=False)
+                else:
+                    st.write("Analysing with AI...")
+                    if chunked_extraction:
+                        extract_pdf_text(uploaded_file, parallel=parallel_extraction)
+                        df = call_chunked_extraction(st.session_state.pdf_pages["pages"], schema=schema_extraction)
+                        structured_data = df.to_json(orient="records", force_ascii=False) if df is not None else None
                     else:
-                        status.update(label="Extraction failed", state="error")
-
-                        if st.button("Try alternative extraction"):
-                            simple_prompt = f"""
-                            Extract metrics from this Google Ads report as simple JSON:
-                            {raw_text[:2000]}
-                            Format: [{{"Metric": "Clicks", "Value": "2025", "Change (%)": 11.3, "Period": "Month on Month"}}]
-                            """
-                            simple_response = call_openai_api(simple_prompt)
-                            if simple_response:
-                                df_simple = parse_structured_data(simple_response)
+                        prompt = fit_prompt(extraction_prompt(schema_extraction), raw_text, "extraction")
+                        preview = st.empty() if stream_responses else None
+                        structured_data, df = call_extraction(prompt, schema_extraction, preview=preview)
+
+                    if structured_data:
+                        if debug_mode:
+                            if st.checkbox("Show AI Response Debug"):
+                                st.code(structured_data, language="json")
+
+                        if df is not None and not df.empty:
+                            st.session_state.extracted_data = df
+                            save_results(report_key, debug_mode, raw_text=raw_text, metrics=df)
+                            status.update(label="Analysis complete", state="complete", expanded=False)
+                        else:
+                            status.update(label="Extraction failed", state="error")
+
+                            if st.button("Try alternative extraction"):
+                                get_parse_stats().count("reasks")
+                                simple_prompt = fit_prompt(get_simple_extraction_prompt, raw_text, "extraction")
+                                _, df_simple = call_extraction(simple_prompt, schema=False)
                                 if df_simple is not None:
                                     st.session_state.extracted_data = df_simple
+                                    save_results(report_key, debug_mode, raw_text=raw_text, metrics=df_simple)
                                     st.rerun()
-                else:
-                    status.update(label="AI analysis failed", state="error")
+                    else:
+                        status.update(label="AI analysis failed", state="error")
             else:
                 status.update(label="Could not extract PDF text", state="error")
 
@@ -1420,53 +2180,8 @@ if uploaded_file:
 </div>
 </div>""", unsafe_allow_html=True)
 
-        if 'Period' in df.columns:
-            mom_metrics = df[df['Period'] == 'Month on Month'] if 'Month on Month' in df['Period'].values else pd.DataFrame()
-            yoy_metrics = df[df['Period'] == 'Year on Year'] if 'Year on Year' in df['Period'].values else pd.DataFrame()
-
-            if not mom_metrics.empty:
-                st.markdown('<p class="period-title">Month on Month</p>', unsafe_allow_html=True)
-
-                cols = st.columns(3)
-                for idx, (_, metric) in enumerate(mom_metrics.iterrows()):
-                    col_idx = idx % 3
-                    formatted_value = format_metric_value(metric['Value'])
-                    formatted_change = format_change_value(metric.get('Change (%)', ''))
-                    change_class = get_change_class(formatted_change)
-                    change_icon = get_change_icon(formatted_change)
-
-                    with cols[col_idx]:
-                        st.markdown(f"""<div class="metric-card">
-<div class="metric-label">{metric['Metric']}</div>
-<div class="metric-period">{metric['Period']}</div>
-<div class="metric-value">{formatted_value}</div>
-{f'<span class="metric-change {change_class}">{change_icon} {formatted_change}</span>' if formatted_change else ''}
-</div>""", unsafe_allow_html=True)
-
-                    if col_idx == 2 and idx < len(mom_metrics) - 1:
-                        cols = st.columns(3)
-
-            if not yoy_metrics.empty:
-                st.markdown('<p class="period-title">Year on Year</p>', unsafe_allow_html=True)
-
-                cols = st.columns(3)
-                for idx, (_, metric) in enumerate(yoy_metrics.iterrows()):
-                    col_idx = idx % 3
-                    formatted_value = format_metric_value(metric['Value'])
-                    formatted_change = format_change_value(metric.get('Change (%)', ''))
-                    change_class = get_change_class(formatted_change)
-                    change_icon = get_change_icon(formatted_change)
-
-                    with cols[col_idx]:
-                        st.markdown(f"""<div class="metric-card">
-<div class="metric-label">{metric['Metric']}</div>
-<div class="metric-period">{metric['Period']}</div>
-<div class="metric-value">{formatted_value}</div>
-{f'<span class="metric-change {change_class}">{change_icon} {formatted_change}</span>' if formatted_change else ''}
-</div>""", unsafe_allow_html=True)
-
-                    if col_idx == 2 and idx < len(yoy_metrics) - 1:
-                        cols = st.columns(3)
+        if 'Period' in df.columns and df['Period'].notna().any():
+            render_metric_grid(df)
         else:
             st.dataframe(df, use_container_width=True)
 
@@ -1511,61 +2226,25 @@ Export Data
 </div>
 </div>""", unsafe_allow_html=True)
 
-            analysis_prompt = f"""
-            You are an online paid advertising expert who manages ad campaigns on behalf of your client. Generate a comprehensive summary report for your client's PPC
-            account with the following metrics provided in the below table:
-
-            {df.to_string(index=False)}
-
-            Analyse both Month on Month and Year on Year performance where available. Include Shopify data if present.
-            Identify key trends and provide insights. Expand on any performance trends and insights.
-
-            Structure your analysis as follows:
-            1. **Traffic & Cost** - Analyse clicks, impressions, CPC, and total cost trends
-            2. **Engagement** - Review CTR, search impression share, and engagement metrics
-            3. **Conversions** - Examine conversion rates, conversion values, ROAS, and revenue metrics
-            4. **Year on Year Comparison** - Compare current performance to the same period last year (if data available)
-            5. **Key Takeaways & Next Steps** - Provide actionable recommendations
-            
-            Write in a personal style. Ensure the tone of voice is friendly but not informal.
-            
-            Write in the present perfect tense, for example rather than "The number of clicks has increased by 6.4%" say "We've seen a significant increase in traffic, with clicks up by 6.4%".
-            
-            Overall we want the analysis to make it seem as though it's 'our' account. This is because when we talk about it, it's our work so the responsibility and performance is on our shoulders.
-            
-            Keep the tone professional but approachable, without excessive formality or technical jargon.
-            
-            Ensure all content is written in UK English(e.g., humanise instead of humanize, colour instead of color) and does not include greetings or sign-offs.
-            
-            Do not use emojis or exclamation marks.
-            
-            You MUST NOT include any of the following words in the response:
-            {banned_words}
-            """
-            with st.spinner("Generating analysis..."):
-                first_analysis = call_openai_api(analysis_prompt)
-
-            if first_analysis:
-                st.session_state.analysis_history.append(first_analysis)
-                st.toast("Analysis complete", icon="✅")
+            if st.session_state.generation_cancelled:
+                st.info("Analysis generation stopped.")
+                if st.button("Generate analysis", key="restart_analysis"):
+                    st.session_state.generation_cancelled = False
+                    st.rerun()
             else:
-                st.error("Failed to generate analysis.")
+                analysis_prompt = get_analysis_prompt(df)
+                first_analysis = generate_analysis(analysis_prompt, 1, stream_responses)
+
+                if first_analysis:
+                    st.session_state.analysis_history.append(first_analysis)
+                    save_results(report_key, debug_mode, analysis=first_analysis)
+                    st.toast("Analysis complete", icon="✅")
+                else:
+                    st.error("Failed to generate analysis.")
 
         # Display Analysis
         for i, analysis in enumerate(st.session_state.analysis_history):
-            st.markdown(f"""<div class="analysis-card">
-<div class="analysis-header">
-<div class="analysis-header-left">
-<div class="analysis-badge">
-<svg viewBox="0 0 24 24"><polygon points="12 2 15.09 8.26 22 9.27 17 14.14 18.18 21.02 12 17.77 5.82 21.02 7 14.14 2 9.27 8.91 8.26 12 2"/></svg>
-</div>
-<div>
-<h3 class="analysis-title">Analysis</h3>
-<span class="analysis-version">Version {i+1}</span>
-</div>
-</div>
-</div>
-<div class="analysis-content">""", unsafe_allow_html=True)
+            st.markdown(analysis_card_header(i + 1), unsafe_allow_html=True)
 
             st.markdown(analysis)
 
@@ -1593,33 +2272,26 @@ Refine this analysis
                 )
 
             with col2:
-                if st.button("Improve", key=f"refine_button_{i}"):
-                    if user_prompt.strip():
-                        with st.spinner("Refining..."):
-                            refine_prompt = f"""
-                            The user provided additional instructions to refine the analysis.
-                            Original analysis:
-                            {analysis}
-
-                            User request:
-                            "{user_prompt}"
-
-                            Provide an improved analysis based on this feedback. Keep the same professional tone and UK English style.
-
-                            You MUST NOT include any of the following words in the response:
-                            {banned_words}
-                            """
-
-                            new_analysis = call_openai_api(refine_prompt)
-
-                            if new_analysis:
-                                st.session_state.analysis_history.append(new_analysis)
-                                st.toast("Refinement complete", icon="✅")
-                                st.rerun()
-                            else:
-                                st.error("Failed to generate refined analysis.")
+                improve_clicked = st.button("Improve", key=f"refine_button_{i}")
+
+            if improve_clicked:
+                if user_prompt.strip():
+                    refine_prompt = get_refinement_prompt(df, analysis, user_prompt)
+
+                    new_analysis = generate_analysis(refine_prompt, len(st.session_state.analysis_history) + 1, stream_responses)
+
+                    if new_analysis:
+                        st.session_state.analysis_history.append(new_analysis)
+                        st.toast("Refinement complete", icon="✅")
+                        st.rerun()
                     else:
-                        st.warning("Please enter instructions first.")
+                        st.error("Failed to generate refined analysis.")
+                else:
+                    st.warning("Please enter instructions first.")
+
+        if st.session_state.generation_cancelled and st.session_state.analysis_history:
+            st.session_state.generation_cancelled = False
+            st.toast("Refinement stopped", icon="⏹️")
 
 else:
     # Welcome State
@@ -0,0 +1,160 @@
+"""Finding banned words in generated analysis.
+
+The analysis prompts ask the model to avoid prompts.BANNED_WORDS, but
+nothing guarantees it does. BannedWordMatcher finds every banned word in a
+text in one pass using an Aho-Corasick automaton, so a check costs the same
+however long the word list grows. Text is split into paragraphs so that
+only the paragraphs containing hits need to be written again.
+"""
+import re
+import threading
+from collections import Counter, deque
+from typing import Optional, Dict, Any, List, Iterable, Tuple
+
+from latency import nearest_rank
+
+# Endings allowed after a banned word, so "delved" and "unlocks" are hits
+# while "diverse" is not a hit for "dive"
+INFLECTIONS = ("s", "es", "d", "ed", "r", "rs", "ly", "ing")
+MAX_INFLECTION = max(len(ending) for ending in INFLECTIONS)
+
+QUOTES = str.maketrans({"‘": "'", "’": "'"})
+WHITESPACE = re.compile(r"\s+")
+# Blank lines between paragraphs, kept when the text is split
+PARAGRAPH_BREAK = re.compile(r"(\n\s*\n)")
+
+def normalise(text: str) -> str:
+    """Lower-case text with curly apostrophes straightened and whitespace runs
+    collapsed to one space, the form words are matched in"""
+    return WHITESPACE.sub(" ", text.lower().translate(QUOTES))
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# MATCHER
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class BannedWordMatcher:
+    """Aho-Corasick automaton over a word list.
+
+    Built once per word list. find() reads each character of the text once
+    and reports every whole-word occurrence of every listed word or phrase,
+    including overlapping ones.
+    """
+
+    def __init__(self, words: Iterable[str]):
+        self.words = sorted({normalise(word).strip() for word in words if word.strip()})
+        self._goto = [{}]       # node -> {char: next node}
+        self._fail = [0]        # node -> longest proper suffix that is also a node
+        self._output = [()]     # node -> words ending at this node
+        for word in self.words:
+            self._insert(word)
+        self._link()
+
+    def _insert(self, word: str):
+        node = 0
+        for char in word:
+            child = self._goto[node].get(char)
+            if child is None:
+                child = len(self._goto)
+                self._goto[node][char] = child
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            node = child
+        self._output[node] += (word,)
+
+    def _link(self):
+        """Set failure links breadth first, so a node's suffix is linked before it"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] += self._output[self._fail[child]]
+
+    def find(self, text: str) -> List[Tuple[int, str]]:
+        """(offset in normalise(text), word) for every banned word in text"""
+        text = normalise(text)
+        goto, fail, output = self._goto, self._fail, self._output
+        hits, node = [], 0
+        for end, char in enumerate(text, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for word in output[node]:
+                start = end - len(word)
+                if is_whole_word(text, start, end):
+                    hits.append((start, word))
+        return hits
+
+    def count(self, text: str) -> Counter:
+        """Occurrences of each banned word in text"""
+        return Counter(word for _, word in self.find(text))
+
+def is_whole_word(text: str, start: int, end: int) -> bool:
+    """Whether text[start:end] is a word of its own, allowing INFLECTIONS after it"""
+    if start > 0 and text[start - 1].isalnum():
+        return False
+    tail = end
+    while tail < len(text) and tail - end <= MAX_INFLECTION and text[tail].isalnum():
+        tail += 1
+    return tail == end or (tail - end <= MAX_INFLECTION and text[end:tail] in INFLECTIONS)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PARAGRAPHS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def split_paragraphs(text: str) -> List[str]:
+    """text split into paragraphs at even indices and the blank lines
+    between them at odd indices, so "".join() gives back text"""
+    return PARAGRAPH_BREAK.split(text)
+
+def flag_paragraphs(matcher: BannedWordMatcher, parts: List[str],
+                    indices: Optional[Iterable[int]] = None) -> Dict[int, Counter]:
+    """Banned word counts for each paragraph of split_paragraphs output that
+    has any, by index. Only the paragraphs at indices are scanned, if given."""
+    flagged = {}
+    for index in range(0, len(parts), 2) if indices is None else indices:
+        hits = matcher.count(parts[index])
+        if hits:
+            flagged[index] = hits
+    return flagged
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# STATS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class BannedWordStats:
+    """Banned word hits in generated analyses and the time spent rewriting
+    the paragraphs they were in, safe to share between threads"""
+
+    def __init__(self, window: int = 500):
+        self._hits = Counter()
+        self._counts = {"scanned": 0, "flagged": 0, "paragraphs_rewritten": 0, "left_in": 0}
+        self._seconds = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record_scan(self, hits: Counter):
+        with self._lock:
+            self._counts["scanned"] += 1
+            if hits:
+                self._counts["flagged"] += 1
+                self._hits.update(hits)
+
+    def record_rewrite(self, paragraphs: int, left_in: int, seconds: float):
+        """Record one analysis's paragraph rewrites and the banned words they failed to remove"""
+        with self._lock:
+            self._counts["paragraphs_rewritten"] += paragraphs
+            self._counts["left_in"] += left_in
+            self._seconds.append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            seconds = sorted(self._seconds)
+            snapshot = dict(self._counts, hits=dict(self._hits.most_common()))
+        for q in (50, 95):
+            snapshot[f"p{q}_rewrite_seconds"] = round(nearest_rank(seconds, q), 2) if seconds else None
+        return snapshot
@@ -0,0 +1,242 @@
+"""Throughput benchmark and fuzz corpus for json_repair.
+
+    python bench_json_repair.py
+    python bench_json_repair.py --max-kb 4096 --fuzz 200 --legacy
+
+Times the parse path extraction replies take when they are not schema-valid
+(repair_json, then salvage_metric_rows) over well-formed, quirky, truncated
+and pathological replies of growing size, plus seeded random mutations of a
+real reply. Exits non-zero if any input raises, if a reply in SHAPES does not give its
+expected rows, or if time per byte at the largest size exceeds
+LINEARITY_TOLERANCE times the time per byte at BASELINE_KB, i.e. if parse
+time stops growing linearly with reply size.
+
+--legacy also times the regex chain the scanner replaced, for comparison.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from typing import Callable, Dict, List, Any, Tuple
+
+from json_repair import repair_json, salvage_metric_rows, load_json
+
+BASELINE_KB = 16
+LINEARITY_TOLERANCE = 3.0
+# The legacy chain is timed up to this size, and only until one call takes
+# longer than LEGACY_MAX_SECONDS - its worst cases take minutes beyond that
+LEGACY_MAX_KB = 64
+LEGACY_MAX_SECONDS = 1.0
+
+ROW = {"Metric": "Cost per Conversion", "Value": "£178.73", "Change (%)": 266.8, "Period": "Month on Month"}
+QUIRKY_ROW = "{'Metric': 'CTR', 'Value': '1.17%', 'Change (%)': -∞%, 'Period': 'Year on Year', 'Flag': True,},\n"
+PERCENT_ROW = '{"Metric": "CTR", "Value": "1.17%", "Change (%)": 12.5%, "Period": "Month on Month"},\n'
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CORPUS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def repeat_to(unit: str, size: int) -> str:
+    return unit * max(size // len(unit), 1)
+
+def fenced_rows(size: int) -> str:
+    row = json.dumps(ROW, ensure_ascii=False) + ",\n"
+    return f"Here are the metrics:\n```json\n[\n{repeat_to(row, size)}]\n```"
+
+CASES: Dict[str, Callable[[int], str]] = {
+    "valid": fenced_rows,
+    "quirky": lambda size: "```json\n[\n" + repeat_to(QUIRKY_ROW, size) + "]\n```",
+    "truncated": lambda size: fenced_rows(size)[: size - 7],
+    "quotes": lambda size: "[" + repeat_to("'", size),
+    "open_braces": lambda size: repeat_to("{", size),
+    "open_brackets": lambda size: repeat_to("[", size),
+    "unterminated_string": lambda size: '[{"Metric": "' + repeat_to("a", size),
+    "bareword": lambda size: "[" + repeat_to("a", size),
+    "commas": lambda size: "[" + repeat_to(",}", size),
+    "infinity": lambda size: "[" + repeat_to("-∞%,", size),
+    "backslashes": lambda size: '["' + repeat_to("\\", size),
+    "keys_without_values": lambda size: "[" + repeat_to("{'Metric': ", size),
+    # Quadratic for the legacy row regex, which backtracks over the whitespace
+    "spaces_after_change": lambda size: '[{"Metric": "Clicks", "Value": "1", "Change (%)": ' + repeat_to(" ", size),
+    "prose": lambda size: repeat_to("The account has performed well. ", size),
+    "note_before_fence": lambda size: "Sure! [Note] " + fenced_rows(size),
+    "percent_change": lambda size: "[\n" + repeat_to(PERCENT_ROW, size) + "]",
+    "brackets_in_prose": lambda size: repeat_to("See [Note] and [1]. ", size) + fenced_rows(size),
+}
+
+# Replies and the (Metric, Change (%)) of each row they must give
+SHAPES: Dict[str, Tuple[str, List[Tuple[str, Any]]]] = {
+    "valid": (fenced_rows(1), [("Cost per Conversion", 266.8)]),
+    "quirky": ("```json\n[\n" + QUIRKY_ROW + "]\n```", [("CTR", None)]),
+    "note_before_fence": (
+        'Sure! [Note] ```json\n[{"Metric":"CTR","Value":"1.17%","Change (%)": -16.9,"Period":"Month on Month"}]\n```',
+        [("CTR", -16.9)],
+    ),
+    "percent_change": ('{"Metric":"CTR","Value":"1%","Change (%)": 12.5%, "Period":"MoM"}', [("CTR", 12.5)]),
+    "truncated": ('[{"Metric": "Clicks", "Value": "2025", "Change (%)": 11.3, "Period": "MoM"}, {"Metric": "Co', [("Clicks", 11.3)]),
+}
+
+def mutate(text: str, rng: random.Random, edits: int) -> str:
+    """text with random characters inserted, deleted or duplicated, biased
+    towards the punctuation the scanner acts on"""
+    alphabet = "{}[]\"',:`%\\∞-+ \nTrueNo0123456789"
+    chars = list(text)
+    for _ in range(edits):
+        pos = rng.randrange(len(chars) + 1)
+        action = rng.random()
+        if action < 0.4:
+            chars.insert(pos, rng.choice(alphabet))
+        elif action < 0.7 and chars:
+            del chars[min(pos, len(chars) - 1)]
+        elif chars:
+            start = min(pos, len(chars) - 1)
+            chars[start:start] = chars[start:start + rng.randint(1, 40)]
+    return "".join(chars)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PARSERS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def scanner_rows(text: str) -> List[Any]:
+    """Rows found by the current parse path, as app.parse_structured_data reads them"""
+    data = load_json(repair_json(text))
+    if isinstance(data, dict):
+        data = data.get("metrics")
+    if isinstance(data, list) and data and all(isinstance(row, dict) for row in data):
+        return data
+    return salvage_metric_rows(text)
+
+def scanner_parse(text: str) -> int:
+    return len(scanner_rows(text))
+
+def legacy_parse(text: str) -> int:
+    """Rows found by the regex chain used before json_repair"""
+    json_str = text
+    if '```json' in json_str:
+        json_str = json_str.split('```json')[1].split('```')[0].strip()
+    elif '```' in json_str:
+        json_str = json_str.split('```')[1].split('```')[0].strip()
+    start_idx = json_str.find('[')
+    end_idx = json_str.rfind(']') + 1
+    if start_idx != -1 and end_idx > start_idx:
+        json_str = json_str[start_idx:end_idx]
+    json_str = re.sub(r"'([^']*)':", r'"\1":', json_str)
+    json_str = re.sub(r":\s*'([^']*)'", r': "\1"', json_str)
+    for marker in ('+∞%', '-∞%', '∞%', '+∞', '-∞', '∞'):
+        json_str = json_str.replace(marker, 'null')
+    json_str = json_str.replace('True', 'true').replace('False', 'false').replace('None', 'null')
+    json_str = re.sub(r',(\s*[}\]])', r'\1', json_str)
+    try:
+        data = json.loads(json_str)
+        if isinstance(data, list) and data:
+            return len(data)
+    except json.JSONDecodeError:
+        pass
+    object_pattern = r'\{\s*"Metric"\s*:\s*"([^"]+)"\s*,\s*"Value"\s*:\s*"([^"]+)"\s*,\s*"Change \(%\)"\s*:\s*([^,}]+)\s*,\s*"Period"\s*:\s*"([^"]+)"\s*\}'
+    return len(re.findall(object_pattern, text, re.DOTALL))
+
+def seconds_per_call(parse: Callable[[str], int], text: str, min_seconds: float = 0.05) -> float:
+    """Best time of repeated runs, repeating small inputs enough to time them"""
+    best, total, runs = float("inf"), 0.0, 0
+    while total < min_seconds or runs < 3:
+        start = time.perf_counter()
+        parse(text)
+        elapsed = time.perf_counter() - start
+        best, total, runs = min(best, elapsed), total + elapsed, runs + 1
+    return best
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# BENCHMARK
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def sizes_kb(max_kb: int) -> List[int]:
+    sizes, size = [], 1
+    while size <= max_kb:
+        sizes.append(size)
+        size *= 4
+    return sizes
+
+def run_benchmark(max_kb: int, legacy: bool) -> List[str]:
+    """Print throughput per case and size, returning the cases that grew non-linearly"""
+    sizes = sizes_kb(max_kb)
+    print(f"{'case':<22}" + "".join(f"{f'{kb}KB':>12}" for kb in sizes) + "   (MB/s, current parser)")
+    nonlinear = []
+    for name, build in CASES.items():
+        per_byte = {}
+        cells = []
+        for kb in sizes:
+            text = build(kb * 1024)
+            per_byte[kb] = seconds_per_call(scanner_parse, text) / len(text)
+            cells.append(f"{1 / per_byte[kb] / 1e6:>12.2f}")
+        print(f"{name:<22}" + "".join(cells))
+
+        baseline = per_byte.get(BASELINE_KB)
+        if baseline and per_byte[sizes[-1]] > LINEARITY_TOLERANCE * baseline:
+            nonlinear.append(name)
+
+        if legacy:
+            cells, too_slow = [], False
+            for kb in sizes:
+                if kb > LEGACY_MAX_KB or too_slow:
+                    cells.append(f"{'-':>12}")
+                    continue
+                text = build(kb * 1024)
+                try:
+                    seconds = seconds_per_call(legacy_parse, text)
+                except RecursionError:
+                    # The legacy chain did not catch this, so the reply crashed the page
+                    cells.append(f"{'crashed':>12}")
+                    continue
+                too_slow = seconds > LEGACY_MAX_SECONDS
+                cells.append(f"{len(text) / seconds / 1e6:>12.2f}")
+            print(f"{'  legacy':<22}" + "".join(cells))
+    return nonlinear
+
+def run_fuzz(samples: int, max_kb: int, seed: int) -> int:
+    """Parse seeded mutations of replies of every size, returning the number that raised"""
+    rng = random.Random(seed)
+    failures, slowest = 0, 0.0
+    for kb in sizes_kb(max_kb):
+        base = fenced_rows(kb * 1024)
+        for _ in range(samples):
+            text = mutate(base, rng, rng.randint(1, 50))
+            start = time.perf_counter()
+            try:
+                scanner_parse(text)
+            except Exception as e:
+                failures += 1
+                print(f"fuzz: {kb}KB input raised {type(e).__name__}: {e}", file=sys.stderr)
+            slowest = max(slowest, (time.perf_counter() - start) / len(text))
+    print(f"fuzz: {samples} mutations per size, {failures} raised, slowest {1 / slowest / 1e6:.2f} MB/s")
+    return failures
+
+def check_shapes() -> List[str]:
+    """Names of SHAPES whose reply did not give the expected rows"""
+    wrong = []
+    for name, (text, expected) in SHAPES.items():
+        rows = [(row.get("Metric"), row.get("Change (%)")) for row in scanner_rows(text)]
+        if rows != expected:
+            wrong.append(name)
+            print(f"shapes: {name} gave {rows}, expected {expected}", file=sys.stderr)
+    print(f"shapes: {len(SHAPES) - len(wrong)} of {len(SHAPES)} parsed as expected")
+    return wrong
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark and fuzz the tolerant JSON scanner")
+    parser.add_argument("--max-kb", type=int, default=1024, help="Largest reply size to time")
+    parser.add_argument("--fuzz", type=int, default=50, help="Mutated replies per size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--legacy", action="store_true", help="Also time the regex chain the scanner replaced")
+    options = parser.parse_args(argv)
+
+    wrong = check_shapes()
+    nonlinear = run_benchmark(options.max_kb, options.legacy)
+    failures = run_fuzz(options.fuzz, min(options.max_kb, 256), options.seed)
+    if nonlinear:
+        print(f"Parse time grew faster than reply size for: {', '.join(nonlinear)}", file=sys.stderr)
+    return 1 if wrong or nonlinear or failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
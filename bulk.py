@@ -0,0 +1,226 @@
+"""Nightly bulk processing of report PDFs through the OpenAI Batch API.
+
+Metrics and analysis for each report are saved to the same result store the
+app reads, so reports processed overnight open instantly the next day.
+
+    OPENAI_API_KEY=... python bulk.py reports/*.pdf
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 python bulk.py reports/*.pdf --poll-interval 2
+
+Batch requests are billed at a discount and count against a separate rate
+limit, in exchange for results arriving within the completion window rather
+than in seconds. Analysis needs the extracted metrics, so a run submits its
+batches in turn: extraction for every report first, then analysis for those
+whose metrics were found, then rewrites of any analysis paragraphs that use
+banned words, the same check the app applies.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Optional, Dict, Any, List
+
+import openai
+import pandas as pd
+
+from banned_words import BannedWordMatcher, BannedWordStats
+from metric_schema import METRICS_RESPONSE_FORMAT, load_schema_rows
+from pdf_extraction import extract_table_metrics
+from pipeline import (
+    FALLBACK_MODEL, STAGE_MODELS, stage_models, read_report_text, prompt_text_budget, fit_prompt,
+    get_schema_extraction_prompt, get_analysis_prompt, table_metrics_frame, metrics_frame, open_result_store, result_key,
+    rewrite_banned_paragraphs
+)
+from prompts import Messages, BANNED_WORDS
+from result_store import ResultStore, content_key
+from token_budget import plan_stage_budget
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+DEFAULT_POLL_SECONDS = 60
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# BATCH JOBS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def batch_request(custom_id: str, messages: Messages, model: str, stage: str, response_format: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """One line of a batch input file, sized like the app's call for the same stage"""
+    body = {
+        "model": model,
+        "messages": messages,
+        "temperature": 0.1,
+        "max_tokens": plan_stage_budget(stage, model)["output_tokens"],
+    }
+    if response_format is not None:
+        body["response_format"] = response_format
+    return {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+
+def run_batch(client: openai.OpenAI, requests: List[Dict[str, Any]], description: str, poll_interval: float) -> Dict[str, Optional[str]]:
+    """Submit requests as one batch and wait for it to finish.
+
+    Returns the reply content for each custom_id, or None for requests that
+    failed or got no reply before the batch ended.
+    """
+    results = dict.fromkeys((request["custom_id"] for request in requests), None)
+    if not requests:
+        return results
+
+    data = "".join(json.dumps(request, ensure_ascii=False) + "\n" for request in requests).encode("utf-8")
+    input_file = client.files.create(file=(f"{description}.jsonl", data), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=BATCH_COMPLETION_WINDOW,
+        metadata={"description": description},
+    )
+    print(f"{description}: submitted {len(requests)} requests as {batch.id}")
+
+    while batch.status not in BATCH_TERMINAL_STATUSES:
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        if counts is not None:
+            print(f"{description}: {batch.status}, {counts.completed}/{counts.total} done, {counts.failed} failed")
+
+    if batch.status != "completed":
+        print(f"{description}: batch ended as {batch.status}", file=sys.stderr)
+    if not batch.output_file_id:
+        return results
+
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if result.get("custom_id") in results and response.get("status_code") == 200:
+            results[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return results
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# REPORTS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def extract_metrics(client: openai.OpenAI, prompts: Dict[str, Messages], poll_interval: float) -> Dict[str, pd.DataFrame]:
+    """Metrics for each report key, via an extraction batch on the routed model
+    and a second batch on the fallback model for any that could not be parsed"""
+    metrics = {}
+    pending = dict(prompts)
+    for attempt, model in enumerate(stage_models("extraction")):
+        requests = [
+            batch_request(key, messages, model, "extraction", METRICS_RESPONSE_FORMAT)
+            for key, messages in pending.items()
+        ]
+        replies = run_batch(client, requests, f"extraction-{attempt + 1}-{model}", poll_interval)
+        for key, reply in replies.items():
+            rows = load_schema_rows(reply)
+            if rows:
+                metrics[key] = metrics_frame(rows)
+                del pending[key]
+        if not pending:
+            break
+    return metrics
+
+def remove_banned_words(client: openai.OpenAI, analyses: Dict[str, str], poll_interval: float) -> Dict[str, str]:
+    """analyses with the paragraphs that use banned words rewritten, one
+    rewrite batch per attempt"""
+    model = STAGE_MODELS.get("rewrite", FALLBACK_MODEL)
+    stats = BannedWordStats()
+
+    def rewrite(prompts: Dict[Any, Messages]) -> Dict[Any, Optional[str]]:
+        ids = {f"{key}:{index}": (key, index) for key, index in prompts}
+        requests = [batch_request(custom_id, prompts[ids[custom_id]], model, "rewrite") for custom_id in ids]
+        replies = run_batch(client, requests, f"rewrite-{model}", poll_interval)
+        return {ids[custom_id]: reply for custom_id, reply in replies.items()}
+
+    analyses = rewrite_banned_paragraphs(analyses, BannedWordMatcher(BANNED_WORDS), rewrite, stats)
+    summary = stats.snapshot()
+    if summary["flagged"]:
+        print(f"banned words: {summary['flagged']}/{summary['scanned']} analyses flagged, "
+              f"{summary['paragraphs_rewritten']} paragraphs rewritten, {summary['left_in']} left in")
+    return analyses
+
+def prepare_reports(paths: List[str], store: ResultStore, force: bool) -> Dict[str, Dict[str, Any]]:
+    """Reports to process, keyed by content, skipping any already stored in full"""
+    reports = {}
+    text_budget = prompt_text_budget(get_schema_extraction_prompt, "extraction")
+    for path in paths:
+        with open(path, "rb") as f:
+            pdf_bytes = f.read()
+        # Matches the app's default extraction mode, which reads these results
+        key = result_key(content_key(pdf_bytes), chunked=False, schema=True)
+        if key in reports:
+            continue
+
+        saved = store.get(key)
+        if not force and saved and saved.get("metrics") is not None and saved.get("analysis"):
+            print(f"{path}: already processed, skipping")
+            continue
+
+        report = {"path": path, "raw_text": None, "metrics": None}
+        try:
+            rows, confidence = extract_table_metrics(pdf_bytes)
+            report["metrics"] = table_metrics_frame(rows, confidence)
+        except Exception:
+            pass
+        if report["metrics"] is None:
+            report["raw_text"] = read_report_text(pdf_bytes, text_budget)
+            if not report["raw_text"]:
+                print(f"{path}: no readable text, skipping", file=sys.stderr)
+                continue
+        reports[key] = report
+    return reports
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Extract and analyse report PDFs in bulk through the Batch API")
+    parser.add_argument("pdfs", nargs="+", help="Report PDFs to process")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_SECONDS, help="Seconds between batch status checks")
+    parser.add_argument("--force", action="store_true", help="Reprocess reports that already have saved results")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        print("OPENAI_API_KEY is not set", file=sys.stderr)
+        return 1
+    client = openai.OpenAI(api_key=api_key, base_url=os.environ.get("OPENAI_BASE_URL") or None)
+    store = open_result_store()
+
+    reports = prepare_reports(options.pdfs, store, options.force)
+    if not reports:
+        return 0
+
+    prompts = {
+        key: fit_prompt(get_schema_extraction_prompt, report["raw_text"], "extraction")
+        for key, report in reports.items() if report["metrics"] is None
+    }
+    for key, df in extract_metrics(client, prompts, options.poll_interval).items():
+        reports[key]["metrics"] = df
+
+    analysis_model = STAGE_MODELS.get("analysis", FALLBACK_MODEL)
+    requests = [
+        batch_request(key, get_analysis_prompt(report["metrics"]), analysis_model, "analysis")
+        for key, report in reports.items() if report["metrics"] is not None and not report["metrics"].empty
+    ]
+    analyses = run_batch(client, requests, f"analysis-{analysis_model}", options.poll_interval)
+    analyses = remove_banned_words(
+        client, {key: analysis for key, analysis in analyses.items() if analysis}, options.poll_interval
+    )
+
+    failed = 0
+    for key, report in reports.items():
+        if report["metrics"] is None or report["metrics"].empty:
+            print(f"{report['path']}: no metrics extracted", file=sys.stderr)
+            failed += 1
+            continue
+        store.put(key, raw_text=report["raw_text"], metrics=report["metrics"], analysis=analyses.get(key))
+        if analyses.get(key):
+            print(f"{report['path']}: saved {len(report['metrics'])} metrics and analysis")
+        else:
+            print(f"{report['path']}: saved {len(report['metrics'])} metrics, analysis failed", file=sys.stderr)
+            failed += 1
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
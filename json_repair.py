@@ -0,0 +1,262 @@
+"""Tolerant, single-pass reading of JSON written by a language model.
+
+Model replies wrap their JSON in code fences or prose, and sometimes use
+single quotes, infinity markers, percent signs after numbers, Python
+literals or trailing commas. The scanner here normalizes all of these in one
+left-to-right pass: every character is looked at once and nothing is
+backtracked. A value that does not decode is rescanned from the next bracket
+at most MAX_RESCANS times, so time grows linearly with the reply however
+malformed it is. bench_json_repair.py measures this.
+"""
+import json
+import re
+from typing import Optional, Dict, Any, List
+
+# Python literals models sometimes write in place of their JSON equivalents
+BAREWORDS = {"True": "true", "False": "false", "None": "null"}
+INFINITY = "∞"
+FENCE = "```"
+# A value that closes but does not decode, e.g. the "[Note]" in
+# "[Note] ```json [...]```", is skipped for the next [ or { after its start,
+# at most this many times
+MAX_RESCANS = 8
+OPENING = re.compile(r"[\[{]")
+
+# Runs handled in one step: text before the JSON starts, string contents up
+# to the next quote or backslash, numbers, separators and whitespace between
+# values, and barewords. Single character classes, so matching cannot backtrack.
+PREAMBLE_RUN = re.compile(r"[^\[{]+")
+STRING_RUNS = {'"': re.compile(r"[^\"\\]+"), "'": re.compile(r"[^'\"\\]+")}
+PLAIN_RUN = re.compile(r"[0-9.,:+\-\s]+")
+WORD_RUN = re.compile(r"[A-Za-z]+")
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# TOLERANT SCANNER
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class TolerantJsonScanner:
+    """Normalizes the first JSON array or object in text fed to it in pieces.
+
+    Skips fences and prose before the value, rewrites single-quoted strings
+    with double quotes, reads infinity markers (with any sign) as null, drops
+    % after numbers, maps Python literals to JSON and drops trailing commas.
+    Scanning stops once the outermost array or object closes; anything
+    after it is ignored.
+
+    Subclasses get on_object(text) for every object that closes without
+    containing another object, with text normalized and ready for json.loads,
+    and on_value() when the outermost value closes.
+    """
+
+    def __init__(self):
+        self._clear()
+        self.done = False
+
+    def _clear(self):
+        """Forget the value being read, ready to look for the next one"""
+        self._out = []          # normalized text of the value being read
+        self._starts = []       # [offset in _out, has nested object] per open object
+        self._depth = 0
+        self._quote = None      # quote character of the string being read
+        self._escape = False
+        self._word = []         # bareword being read, e.g. True
+
+    def feed(self, text: str):
+        """Consume the next piece of text"""
+        i, end = 0, len(text)
+        while i < end and not self.done:
+            run = self._match_run(text, i)
+            if run is None:
+                self._consume(text[i])
+                i += 1
+                continue
+            if run.re is WORD_RUN:
+                self._word.append(run.group())
+            elif self._depth:
+                self._out.append(run.group())
+            i = run.end()
+
+    def _match_run(self, text: str, i: int) -> Optional[re.Match]:
+        if self._quote is not None:
+            return None if self._escape else STRING_RUNS[self._quote].match(text, i)
+        if self._depth == 0:
+            return PREAMBLE_RUN.match(text, i)
+        if self._word:
+            return WORD_RUN.match(text, i)
+        return PLAIN_RUN.match(text, i) or WORD_RUN.match(text, i)
+
+    def text(self) -> str:
+        """The normalized value read so far"""
+        return "".join(self._out) + self._pending_word()
+
+    def on_object(self, text: str):
+        pass
+
+    def on_value(self):
+        self.done = True
+
+    def _pending_word(self) -> str:
+        word = "".join(self._word)
+        return BAREWORDS.get(word, word)
+
+    def _consume(self, char: str):
+        if self._quote is not None:
+            self._string_char(char)
+            return
+
+        if self._depth == 0:
+            self._open(char)
+            return
+
+        if self._word and not char.isalpha():
+            self._out.append(self._pending_word())
+            self._word = []
+
+        if char.isalpha():
+            self._word.append(char)
+        elif char in "\"'":
+            self._quote = char
+            self._out.append('"')
+        elif char == INFINITY:
+            if self._strip_trailing_space().endswith(("+", "-")):
+                self._out[-1] = self._out[-1][:-1]
+            self._out.append("null")
+        elif char in "[{":
+            self._open(char)
+        elif char in "]}":
+            self._close(char)
+        elif char not in "`%":
+            # % after a number, e.g. 12.5%, or after an infinity marker
+            self._out.append(char)
+
+    def _string_char(self, char: str):
+        if self._escape:
+            self._escape = False
+            # \' is not a JSON escape, and the quote needs none inside "..."
+            self._out.append("'" if char == "'" else "\\" + char)
+        elif char == "\\":
+            self._escape = True
+        elif char == self._quote:
+            self._quote = None
+            self._out.append('"')
+        elif char == '"':
+            self._out.append('\\"')
+        else:
+            self._out.append(char)
+
+    def _open(self, char: str):
+        self._depth += 1
+        if char == "{":
+            if self._starts:
+                self._starts[-1][1] = True
+            self._starts.append([len(self._out), False])
+        self._out.append(char)
+
+    def _strip_trailing_space(self) -> str:
+        """Drop whitespace from the end of the output, returning its last entry"""
+        while self._out:
+            last = self._out[-1].rstrip()
+            if last:
+                self._out[-1] = last
+                return last
+            self._out.pop()
+        return ""
+
+    def _close(self, char: str):
+        if self._strip_trailing_space().endswith(","):
+            self._out[-1] = self._out[-1][:-1]
+        self._out.append(char)
+        self._depth -= 1
+
+        if char == "}" and self._starts:
+            start, nested = self._starts.pop()
+            # Objects holding other objects are left to the caller, so no
+            # character is decoded twice
+            if not nested:
+                self.on_object("".join(self._out[start:]))
+        if self._depth <= 0:
+            self.on_value()
+
+def reply_start(text: str) -> int:
+    """Offset of the first ``` fence that has a value after it, or 0. Fenced
+    content is preferred to anything in the prose before it."""
+    fence = text.find(FENCE)
+    return fence if fence != -1 and OPENING.search(text, fence) else 0
+
+def repair_json(text: str) -> str:
+    """The first JSON array or object in a model reply that decodes,
+    normalized so that json.loads can read it, or "" when the reply has none.
+
+    Values that close without decoding are skipped, up to MAX_RESCANS times;
+    the first value is returned when none decodes.
+    """
+    opening = OPENING.search(text, reply_start(text))
+    first = ""
+    for attempt in range(MAX_RESCANS + 1):
+        if opening is None:
+            break
+        scanner = TolerantJsonScanner()
+        scanner.feed(text[opening.start():])
+        candidate = scanner.text()
+        if attempt == 0:
+            first = candidate
+        # A value cut off before it closed is left to salvage_metric_rows
+        if not scanner.done or load_json(candidate) is not None:
+            return candidate
+        opening = OPENING.search(text, opening.start() + 1)
+    return first
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# METRIC ROWS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class MetricStreamParser(TolerantJsonScanner):
+    """Incremental parser for an extraction reply that arrives in pieces.
+
+    Each call to feed() takes the next piece of the reply and returns the
+    metric rows - objects with a "Metric" key - that it completed, so rows
+    can be shown while the rest of the reply is still being written. Rows
+    completed before a reply was cut off are kept. Values holding no rows,
+    e.g. "[Note]" in prose before the JSON, are skipped.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self._completed = []
+        self._value_rows = 0
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """Consume the next piece of the reply, returning the rows it completed"""
+        super().feed(text)
+        rows, self._completed = self._completed, []
+        self.rows.extend(rows)
+        return rows
+
+    def on_object(self, text: str):
+        row = load_json(text)
+        if isinstance(row, dict) and "Metric" in row:
+            self._completed.append(row)
+            self._value_rows += 1
+
+    def on_value(self):
+        if self._value_rows:
+            self.done = True
+        else:
+            self._clear()
+
+def load_json(text: str) -> Optional[Any]:
+    """json.loads that returns None for invalid or too deeply nested JSON and
+    allows raw newlines in strings"""
+    try:
+        return json.loads(text, strict=False)
+    except (ValueError, RecursionError):
+        # RecursionError: nesting too deep to decode
+        return None
+
+def salvage_metric_rows(text: str) -> List[Dict[str, Any]]:
+    """Every complete metric row in a reply, even when the reply as a whole
+    is invalid or truncated. Rows in fenced content are preferred."""
+    start = reply_start(text)
+    rows = MetricStreamParser().feed(text[start:])
+    return rows or (MetricStreamParser().feed(text[:start]) if start else [])
@@ -0,0 +1,140 @@
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, FIRST_COMPLETED, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional, Dict, Any, List, Callable, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# A stage is only hedged once this many latencies have been seen for it
+MIN_HEDGE_SAMPLES = 20
+LATENCY_PERCENTILES = (50, 95, 99)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# LATENCY PERCENTILES
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def nearest_rank(samples: List[float], q: float) -> float:
+    """q-th percentile of sorted, non-empty samples by the nearest-rank method"""
+    return samples[max(math.ceil(q / 100 * len(samples)) - 1, 0)]
+
+class LatencyTracker:
+    """Recent call latencies per stage, safe to share between threads"""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, stage: str, q: float) -> Optional[float]:
+        """Nearest-rank q-th percentile of the stage's recent latencies"""
+        with self._lock:
+            samples = sorted(self._samples.get(stage, ()))
+        if not samples:
+            return None
+        return nearest_rank(samples, q)
+
+    def hedge_delay(self, stage: str) -> Optional[float]:
+        """Seconds after which a call in stage is slower than 95% of recent
+        calls, or None until there are enough samples to tell"""
+        with self._lock:
+            count = len(self._samples.get(stage, ()))
+        return self.percentile(stage, 95) if count >= MIN_HEDGE_SAMPLES else None
+
+    def summary(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            stages = {stage: sorted(samples) for stage, samples in self._samples.items()}
+
+        rows = []
+        for stage, samples in sorted(stages.items()):
+            row = {"stage": stage, "samples": len(samples)}
+            for q in LATENCY_PERCENTILES:
+                row[f"p{q}_seconds"] = round(nearest_rank(samples, q), 2)
+            rows.append(row)
+        return rows
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# HEDGED REQUESTS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class HedgeBudget:
+    """Caps duplicate requests at max_share of all calls.
+
+    Each hedge is a second, billed request for the same reply, so hedging
+    stops whenever it would take the share of hedged calls past the cap.
+    """
+
+    def __init__(self, max_share: float = 0.05):
+        self.max_share = max_share
+        self._calls = 0
+        self._hedges = 0
+        self._wins = 0
+        self._lock = threading.Lock()
+
+    def note_call(self):
+        with self._lock:
+            self._calls += 1
+
+    def try_spend(self, admit: Callable[[], bool] = lambda: True) -> bool:
+        """Take one hedge from the budget if it has room and admit() agrees"""
+        with self._lock:
+            if self._hedges + 1 > self.max_share * self._calls or not admit():
+                return False
+            self._hedges += 1
+            return True
+
+    def note_win(self):
+        """Record that a hedge finished before the request it duplicated"""
+        with self._lock:
+            self._wins += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"calls": self._calls, "hedges": self._hedges, "wins": self._wins}
+
+def hedged_call(executor: Executor, call: Callable[[], T], hedge_after: Optional[float],
+                may_hedge: Callable[[], bool], timeout: Optional[float] = None) -> Tuple[T, bool]:
+    """Run call, and run it a second time if it is still going after
+    hedge_after seconds and may_hedge() allows it.
+
+    Returns the first successful result and whether it came from the hedge.
+    The slower request is left to finish in the background and its result is
+    discarded. Raises the first error only when every request failed, and
+    TimeoutError once timeout seconds pass without a result - requests still
+    queued for a thread of the executor are then cancelled.
+    """
+    end = None if timeout is None else time.monotonic() + timeout
+
+    def remaining() -> Optional[float]:
+        return None if end is None else max(end - time.monotonic(), 0.0)
+
+    primary = executor.submit(call)
+    if hedge_after is not None and timeout is not None and hedge_after >= timeout:
+        hedge_after = None
+    if hedge_after is None or wait([primary], timeout=hedge_after).done or not may_hedge():
+        try:
+            return primary.result(timeout=remaining()), False
+        except FutureTimeoutError:
+            primary.cancel()
+            raise TimeoutError(f"No reply within {timeout:g}s") from None
+
+    hedge = executor.submit(call)
+    pending = {primary, hedge}
+    first_error = None
+    while pending:
+        done, pending = wait(pending, timeout=remaining(), return_when=FIRST_COMPLETED)
+        if not done:
+            for future in pending:
+                future.cancel()
+            raise TimeoutError(f"No reply within {timeout:g}s")
+        for future in done:
+            if future.exception() is None:
+                return future.result(), future is hedge
+            first_error = first_error or future.exception()
+    raise first_error
@@ -0,0 +1,250 @@
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Optional, Dict, Iterator, Callable, Any
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache.sqlite3")
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# LLM RESPONSE CACHE
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def response_cache_key(model: str, stage: str, prompt_hash: str) -> str:
+    """Cache key for one model response"""
+    return f"{model}:{stage}:{prompt_hash}"
+
+class ResponseCache(ABC):
+    """Interface for LLM response caches"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """Cached response for key, or None on a miss"""
+
+    @abstractmethod
+    def put(self, key: str, response: str, model: str = "", stage: str = ""):
+        """Cache response under key"""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        """Hit, miss, entry and byte counts"""
+
+class MemoryResponseCache(ResponseCache):
+    """Per-process cache with the same TTL and LRU size cap as the SQLite one"""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl: float = DEFAULT_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                self._misses += 1
+                return None
+            # Re-inserting moves the entry to the most recently used end
+            self._entries[key] = entry
+            self._hits += 1
+            return entry[1]
+
+    def put(self, key: str, response: str, model: str = "", stage: str = ""):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), response)
+            total = sum(len(text.encode()) for _, text in self._entries.values())
+            while total > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                total -= len(self._entries.pop(oldest)[1].encode())
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "entries": len(self._entries),
+                "bytes": sum(len(text.encode()) for _, text in self._entries.values()),
+            }
+
+class SQLiteResponseCache(ResponseCache):
+    """Response cache in a local SQLite file, shared by every process on the host.
+
+    WAL mode lets readers in other Streamlit workers proceed while one of them
+    writes. Entries older than ttl are treated as misses. Once the stored
+    responses exceed max_bytes the least recently read entries are evicted.
+    Hit and miss counters live in the database, so they cover all workers.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES, ttl: float = DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, stage TEXT, response TEXT NOT NULL, "
+                "size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # A connection per operation keeps the cache safe to use from any thread
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _count(self, conn: sqlite3.Connection, name: str):
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None or now - row[1] > self.ttl:
+                    if row is not None:
+                        conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._count(conn, "misses")
+                    return None
+                conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                self._count(conn, "hits")
+                return row[0]
+        except sqlite3.Error:
+            return None
+
+    def put(self, key: str, response: str, model: str = "", stage: str = ""):
+        now = time.time()
+        size = len(response.encode())
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, stage, response, size, created, accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, model, stage, response, size, now, now)
+                )
+                conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                self._evict(conn)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self) -> Dict[str, int]:
+        try:
+            with self._connect() as conn:
+                counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+                entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        except sqlite3.Error:
+            return {"hits": 0, "misses": 0, "entries": 0, "bytes": 0}
+        return {"hits": counters.get("hits", 0), "misses": counters.get("misses", 0), "entries": entries, "bytes": size}
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# SINGLE-FLIGHT CALLS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.interrupted = False
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one.
+
+    The first caller for a key runs the call; callers arriving while it is in
+    flight wait for it and share its result or exception. A call interrupted
+    by a BaseException (e.g. a Streamlit rerun stopping the leader's script)
+    is not shared - the next waiter runs the call itself instead.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._leaders = 0
+        self._coalesced = 0
+
+    def do(self, key: str, call: Callable[[], Any], on_wait: Optional[Callable[[], None]] = None, poll: float = 0.5) -> Any:
+        """Run call for key, or wait for the identical call in flight.
+
+        While waiting, on_wait is called about every poll seconds, so a caller
+        can show progress and be interrupted. Exceptions from on_wait (e.g. a
+        Streamlit rerun) stop the wait; the call in flight carries on.
+        """
+        waited = False
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                    self._leaders += 1
+                elif not waited:
+                    # A waiter that ends up leading after an interrupted flight is still counted once
+                    waited = True
+                    self._coalesced += 1
+
+            if leader:
+                return self._lead(key, flight, call)
+
+            while not flight.done.wait(poll):
+                if on_wait is not None:
+                    on_wait()
+            if flight.interrupted:
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+    def _lead(self, key: str, flight: _Flight, call: Callable[[], Any]) -> Any:
+        try:
+            flight.result = call()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        except BaseException:
+            flight.interrupted = True
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"calls": self._leaders, "coalesced": self._coalesced, "in_flight": len(self._flights)}
+
+def create_response_cache(backend: str = "sqlite", **kwargs) -> ResponseCache:
+    """Build the response cache named by backend ("sqlite" or "memory")"""
+    if backend == "memory":
+        kwargs.pop("path", None)
+        return MemoryResponseCache(**kwargs)
+    if backend == "sqlite":
+        return SQLiteResponseCache(**kwargs)
+    raise ValueError(f"Unknown response cache backend: {backend}")
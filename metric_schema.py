@@ -0,0 +1,90 @@
+import json
+import threading
+from typing import Optional, Dict, Any, List
+
+METRIC_COLUMNS = ["Metric", "Value", "Change (%)", "Period"]
+
+# Structured outputs need an object at the top level, so rows sit under "metrics"
+METRIC_ROW_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "Metric": {"type": "string"},
+        "Value": {"type": "string"},
+        "Change (%)": {"type": ["number", "null"]},
+        "Period": {"type": "string"},
+    },
+    "required": METRIC_COLUMNS,
+    "additionalProperties": False,
+}
+METRICS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "report_metrics",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"metrics": {"type": "array", "items": METRIC_ROW_SCHEMA}},
+            "required": ["metrics"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# SCHEMA VALIDATION
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def is_metric_row(row: Any) -> bool:
+    """Whether row matches METRIC_ROW_SCHEMA"""
+    if not isinstance(row, dict) or set(row) != set(METRIC_COLUMNS):
+        return False
+    change = row["Change (%)"]
+    return (
+        isinstance(row["Metric"], str)
+        and isinstance(row["Value"], str)
+        and isinstance(row["Period"], str)
+        and (change is None or (isinstance(change, (int, float)) and not isinstance(change, bool)))
+    )
+
+def load_schema_rows(response: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+    """Metric rows from a schema-constrained response, or None if it does not
+    match the schema or holds no rows"""
+    if not response:
+        return None
+    try:
+        data = json.loads(response)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("metrics"), list):
+        return None
+    rows = data["metrics"]
+    if not rows or not all(is_metric_row(row) for row in rows):
+        return None
+    return rows
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PARSE OUTCOMES
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class ParseStats:
+    """Counts of how extraction responses were turned into metrics.
+
+    schema_valid - parsed in one pass against the schema
+    repaired - needed the JSON repair pipeline
+    failed - could not be parsed at all
+    reasks - extra extraction calls made after a failure
+    """
+
+    OUTCOMES = ("schema_valid", "repaired", "failed", "reasks")
+
+    def __init__(self):
+        self._counts = dict.fromkeys(self.OUTCOMES, 0)
+        self._lock = threading.Lock()
+
+    def count(self, outcome: str):
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
@@ -0,0 +1,513 @@
+"""Local stand-in for the OpenAI chat completions and batch APIs.
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8765/v1 to run
+without network access or API spend.
+
+    python openai_stub.py --mode replay --fixtures fixtures
+    python openai_stub.py --mode record --fixtures fixtures --upstream https://api.openai.com/v1
+    python openai_stub.py --mode canned --first-token-latency 0.5 --tokens-per-second 80
+
+replay - serve responses recorded earlier, 404 for requests never recorded
+record - forward to the upstream API, save each response as a fixture, then serve it
+canned - serve a fixed reply of the right shape for every request
+
+Batch jobs (/v1/files and /v1/batches, as used by bulk.py) are answered
+from the same fixtures, or canned replies, once --batch-delay has passed.
+"""
+import argparse
+import email.policy
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, Iterator, List
+
+from metric_schema import METRIC_COLUMNS
+from token_budget import count_message_tokens, count_tokens
+
+DEFAULT_PORT = 8765
+DEFAULT_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+CANNED_METRICS = [
+    dict(zip(METRIC_COLUMNS, row)) for row in (
+        ("Clicks", "2025", 11.3, "Month on Month"),
+        ("Impressions", "173.25K", 33.9, "Month on Month"),
+        ("Cost", "£1564.51", 22.4, "Month on Month"),
+        ("Conversions", "8.75", -66.6, "Month on Month"),
+        ("Clicks", "1874", 8.1, "Year on Year"),
+        ("Cost", "£1402.10", 11.6, "Year on Year"),
+    )
+]
+CANNED_ANALYSIS = (
+    "1. **Traffic & Cost**\n\nWe've seen clicks rise by 11.3% month on month while cost has grown by 22.4%.\n\n"
+    "2. **Engagement**\n\nImpressions have increased by 33.9%, widening the account's reach.\n\n"
+    "3. **Conversions**\n\nConversions have fallen by 66.6%, which we are reviewing as a priority.\n\n"
+    "4. **Year on Year Comparison**\n\nClicks are up 8.1% on last year for an 11.6% increase in cost.\n\n"
+    "5. **Key Takeaways & Next Steps**\n\nWe'll focus budget on the campaigns that have converted best."
+)
+# Streamed output is split into word-sized pieces, roughly one token each
+STREAM_PIECE_PATTERN = re.compile(r"\s*\S+|\s+$")
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# FIXTURES
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def fixture_key(request: Dict[str, Any]) -> str:
+    """Key of a chat request: everything that determines the reply's content.
+
+    max_tokens and stream are left out so changing budgets or switching
+    between streamed and blocking calls still replays the same fixture.
+    """
+    identity = {
+        "model": request.get("model"),
+        "messages": request.get("messages"),
+        "response_format": request.get("response_format"),
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:24]
+
+class FixtureStore:
+    """Recorded replies, one JSON file per request key"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(fixture_key(request)), encoding="utf-8") as f:
+                return json.load(f)["reply"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, request: Dict[str, Any], reply: Dict[str, Any]):
+        path = self._path(fixture_key(request))
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"request": request, "reply": reply}, f, ensure_ascii=False, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# REPLIES
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def canned_reply(request: Dict[str, Any]) -> Dict[str, Any]:
+    """Fixed reply matching what the request asks for"""
+    response_format = request.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        content = json.dumps({"metrics": CANNED_METRICS}, ensure_ascii=False)
+    elif "JSON" in request["messages"][-1]["content"]:
+        content = json.dumps(CANNED_METRICS, ensure_ascii=False)
+    else:
+        content = CANNED_ANALYSIS
+    return {"content": content, "usage": None}
+
+def record_reply(request: Dict[str, Any], upstream: str, api_key: str) -> Dict[str, Any]:
+    """Make the request against the real API, always unstreamed so the full
+    reply and its usage can be stored"""
+    body = {key: value for key, value in request.items() if key not in ("stream", "stream_options")}
+    upstream_request = urllib.request.Request(
+        f"{upstream.rstrip('/')}/chat/completions",
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"},
+    )
+    with urllib.request.urlopen(upstream_request, timeout=300) as response:
+        completion = json.load(response)
+    return {"content": completion["choices"][0]["message"]["content"], "usage": completion.get("usage")}
+
+def reply_usage(request: Dict[str, Any], reply: Dict[str, Any]) -> Dict[str, int]:
+    """Recorded usage, or an estimate for canned replies"""
+    if reply.get("usage"):
+        return reply["usage"]
+    model = request.get("model", "")
+    prompt_tokens = count_message_tokens(request["messages"], model)
+    completion_tokens = count_tokens(reply["content"], model)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+def completion_body(request: Dict[str, Any], reply: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": reply["content"]}, "finish_reason": "stop"}],
+        "usage": reply_usage(request, reply),
+    }
+
+def stream_chunks(request: Dict[str, Any], reply: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Chunks of a streamed reply, in the order the API sends them"""
+    base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion.chunk", "created": int(time.time()), "model": request.get("model")}
+    yield {**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}
+    for piece in STREAM_PIECE_PATTERN.findall(reply["content"]):
+        yield {**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+    yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    if (request.get("stream_options") or {}).get("include_usage"):
+        yield {**base, "choices": [], "usage": reply_usage(request, reply)}
+
+class ReplyError(Exception):
+    """A chat request the stub cannot answer, with the error response to send"""
+
+    def __init__(self, status: int, body: bytes, headers: Optional[Dict[str, str]] = None):
+        super().__init__(status)
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    @classmethod
+    def of(cls, status: int, message: str, error_type: str) -> "ReplyError":
+        return cls(status, json.dumps(error_body(message, error_type)).encode())
+
+def error_body(message: str, error_type: str) -> Dict[str, Any]:
+    return {"error": {"message": message, "type": error_type, "code": None}}
+
+def resolve_reply(options: argparse.Namespace, fixtures: FixtureStore, request: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+    """Reply for a chat request in the configured mode, raising ReplyError
+    when there is none"""
+    if options.mode == "canned":
+        return canned_reply(request)
+
+    reply = fixtures.get(request)
+    if reply is not None:
+        return reply
+
+    if options.mode == "record":
+        try:
+            reply = record_reply(request, options.upstream, os.environ.get("OPENAI_API_KEY") or api_key)
+        except urllib.error.HTTPError as e:
+            # Pass upstream errors through, including rate-limit headers
+            headers = {header: e.headers[header] for header in ("retry-after", "retry-after-ms") if e.headers.get(header)}
+            raise ReplyError(e.code, e.read(), headers)
+        except urllib.error.URLError as e:
+            raise ReplyError.of(502, f"Upstream unreachable: {e.reason}", "api_error")
+        fixtures.put(request, reply)
+        return reply
+
+    raise ReplyError.of(404, f"No fixture recorded for request {fixture_key(request)}", "invalid_request_error")
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# BATCHES
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class BatchStore:
+    """Uploaded files and batch jobs, held in memory for the life of the server.
+
+    A batch is answered line by line in a background thread, the same way
+    the chat endpoint answers single requests, after batch_delay seconds
+    standing in for the time a real batch waits in the provider's queue.
+    """
+
+    def __init__(self, options: argparse.Namespace, fixtures: FixtureStore):
+        self.options = options
+        self.fixtures = fixtures
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+
+    def add_file(self, filename: str, purpose: str, content: bytes) -> Dict[str, Any]:
+        meta = {
+            "id": f"file-{uuid.uuid4().hex[:24]}",
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        with self.lock:
+            self.files[meta["id"]] = {"meta": meta, "content": content}
+        return meta
+
+    def file_content(self, file_id: str) -> Optional[bytes]:
+        with self.lock:
+            entry = self.files.get(file_id)
+        return entry["content"] if entry else None
+
+    def create_batch(self, request: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": request.get("endpoint"),
+            "input_file_id": request.get("input_file_id"),
+            "completion_window": request.get("completion_window", "24h"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "errors": None,
+            "created_at": int(time.time()),
+            "in_progress_at": None,
+            "completed_at": None,
+            "failed_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": request.get("metadata"),
+        }
+        with self.lock:
+            self.batches[batch["id"]] = batch
+        threading.Thread(target=self._run, args=(batch["id"], api_key), daemon=True).start()
+        return self.get_batch(batch["id"])
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            return json.loads(json.dumps(batch)) if batch else None
+
+    def _update(self, batch_id: str, **fields):
+        with self.lock:
+            self.batches[batch_id].update(fields)
+
+    def _fail(self, batch_id: str, code: str, message: str):
+        self._update(batch_id, status="failed", failed_at=int(time.time()), errors={"object": "list", "data": [{"code": code, "message": message}]})
+
+    def _run(self, batch_id: str, api_key: str):
+        # Anything escaping the per-line handling fails the batch rather than
+        # leaving it in progress for ever
+        try:
+            self._answer(batch_id, api_key)
+        except Exception as e:
+            self._fail(batch_id, "server_error", f"{type(e).__name__}: {e}")
+
+    def _answer(self, batch_id: str, api_key: str):
+        batch = self.get_batch(batch_id)
+        content = self.file_content(batch["input_file_id"])
+        if content is None or batch["endpoint"] != "/v1/chat/completions":
+            message = "Input file not found" if content is None else f"Unsupported endpoint {batch['endpoint']}"
+            self._fail(batch_id, "invalid_request", message)
+            return
+
+        lines = [line for line in content.decode("utf-8").splitlines() if line.strip()]
+        counts = {"total": len(lines), "completed": 0, "failed": 0}
+        self._update(batch_id, status="in_progress", in_progress_at=int(time.time()), request_counts=dict(counts))
+        time.sleep(self.options.batch_delay)
+
+        outputs, errors = [], []
+        for number, line in enumerate(lines, 1):
+            result = {"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": None, "response": None, "error": None}
+            try:
+                line = json.loads(line)
+                result["custom_id"] = line.get("custom_id")
+                request = dict(line["body"])
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                result["error"] = {"code": "invalid_request", "message": f"Line {number} is not a batch request: {e}"}
+            else:
+                try:
+                    reply = resolve_reply(self.options, self.fixtures, request, api_key)
+                    result["response"] = {"status_code": 200, "request_id": uuid.uuid4().hex, "body": completion_body(request, reply)}
+                except ReplyError as e:
+                    result["response"] = {"status_code": e.status, "request_id": uuid.uuid4().hex, "body": json.loads(e.body or b"null")}
+                except Exception as e:
+                    # e.g. the upstream API unreachable in record mode
+                    result["error"] = {"code": "server_error", "message": f"{type(e).__name__}: {e}"}
+
+            if result["response"] is not None and result["response"]["status_code"] == 200:
+                outputs.append(result)
+                counts["completed"] += 1
+            else:
+                errors.append(result)
+                counts["failed"] += 1
+            self._update(batch_id, request_counts=dict(counts))
+
+        def write(results):
+            if not results:
+                return None
+            data = "".join(json.dumps(result, ensure_ascii=False) + "\n" for result in results).encode("utf-8")
+            return self.add_file(f"{batch_id}_output.jsonl", "batch_output", data)["id"]
+
+        self._update(batch_id, status="completed", completed_at=int(time.time()), output_file_id=write(outputs), error_file_id=write(errors))
+
+def parse_multipart(content_type: str, body: bytes) -> Dict[str, Any]:
+    """Form fields of a multipart upload: text for plain fields, (filename, bytes) for files"""
+    message = BytesParser(policy=email.policy.default).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        data = part.get_payload(decode=True) or b""
+        fields[name] = (part.get_filename(), data) if part.get_filename() else data.decode("utf-8")
+    return fields
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# SERVER
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Set on the subclass built by make_handler
+    options = None
+    fixtures = None
+    batches = None
+    lock = threading.Lock()
+    served = {"requests": 0, "misses": 0}
+
+    def log_message(self, format, *args):
+        if self.options.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status: int, body: Dict[str, Any]):
+        self.send_body(status, json.dumps(body).encode(), "application/json")
+
+    def send_body(self, status: int, data: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status: int, message: str, error_type: str):
+        self.send_json(status, error_body(message, error_type))
+
+    @property
+    def api_key(self) -> str:
+        return self.headers.get("Authorization", "").removeprefix("Bearer ")
+
+    def route(self) -> List[str]:
+        """Path segments after /v1"""
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        return parts[1:] if parts[:1] == ["v1"] else parts
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        route = self.route()
+        if route == ["stats"]:
+            with self.lock:
+                self.send_json(200, dict(self.served))
+        elif len(route) == 2 and route[0] == "batches":
+            batch = self.batches.get_batch(route[1])
+            if batch is None:
+                self.send_error_json(404, f"No batch {route[1]}", "invalid_request_error")
+            else:
+                self.send_json(200, batch)
+        elif len(route) == 3 and route[0] == "files" and route[2] == "content":
+            content = self.batches.file_content(route[1])
+            if content is None:
+                self.send_error_json(404, f"No file {route[1]}", "invalid_request_error")
+            else:
+                self.send_body(200, content, "application/octet-stream")
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}", "invalid_request_error")
+
+    def do_POST(self):
+        route = self.route()
+        if route == ["chat", "completions"]:
+            self.post_chat()
+        elif route == ["files"]:
+            fields = parse_multipart(self.headers.get("Content-Type", ""), self.read_body())
+            if not isinstance(fields.get("file"), tuple):
+                self.send_error_json(400, "Missing file upload", "invalid_request_error")
+                return
+            filename, content = fields["file"]
+            self.send_json(200, self.batches.add_file(filename, fields.get("purpose", "batch"), content))
+        elif route == ["batches"]:
+            try:
+                request = json.loads(self.read_body())
+            except ValueError:
+                self.send_error_json(400, "Request body is not valid JSON", "invalid_request_error")
+                return
+            self.send_json(200, self.batches.create_batch(request, self.api_key))
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}", "invalid_request_error")
+
+    def post_chat(self):
+        try:
+            request = json.loads(self.read_body())
+        except ValueError:
+            self.send_error_json(400, "Request body is not valid JSON", "invalid_request_error")
+            return
+
+        try:
+            reply = resolve_reply(self.options, self.fixtures, request, self.api_key)
+        except ReplyError as e:
+            if e.status == 404:
+                with self.lock:
+                    self.served["misses"] += 1
+            self.send_body(e.status, e.body, "application/json", e.headers)
+            return
+
+        with self.lock:
+            self.served["requests"] += 1
+
+        time.sleep(self.latency(self.options.first_token_latency))
+        if request.get("stream"):
+            self.stream_reply(request, reply)
+        else:
+            pieces = len(STREAM_PIECE_PATTERN.findall(reply["content"]))
+            if self.options.tokens_per_second:
+                time.sleep(pieces / self.options.tokens_per_second)
+            self.send_json(200, completion_body(request, reply))
+
+    def latency(self, seconds: float) -> float:
+        return max(seconds * (1 + random.uniform(-self.options.jitter, self.options.jitter)), 0)
+
+    def stream_reply(self, request: Dict[str, Any], reply: Dict[str, Any]):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        delay = 1 / self.options.tokens_per_second if self.options.tokens_per_second else 0
+        try:
+            for chunk in stream_chunks(request, reply):
+                self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+                if delay and chunk["choices"] and chunk["choices"][0]["delta"].get("content"):
+                    time.sleep(self.latency(delay))
+            self.write_chunk(b"data: [DONE]\n\n")
+            self.write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, e.g. the user pressed stop
+            pass
+
+    def write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+def make_handler(options: argparse.Namespace) -> type:
+    """Request handler class bound to these options and their fixture store"""
+    fixtures = FixtureStore(options.fixtures)
+    return type("BoundStubHandler", (StubHandler,), {
+        "options": options,
+        "fixtures": fixtures,
+        "batches": BatchStore(options, fixtures),
+        "lock": threading.Lock(),
+        "served": {"requests": 0, "misses": 0},
+    })
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat completions API")
+    parser.add_argument("--mode", choices=("replay", "record", "canned"), default="replay")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES_DIR, help="Directory of recorded replies")
+    parser.add_argument("--upstream", default="https://api.openai.com/v1", help="API recorded from in record mode")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--first-token-latency", type=float, default=0.0, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Output speed, 0 for instant")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- share applied to each delay")
+    parser.add_argument("--batch-delay", type=float, default=0.0, help="Seconds a batch waits before it is processed")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    options = parse_args(argv)
+    server = ThreadingHTTPServer((options.host, options.port), make_handler(options))
+    print(f"Serving {options.mode} responses on http://{options.host}:{options.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import io
+import mmap
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Iterator, Tuple, Union
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import pdfplumber
+
+# Pages handed to a worker per task. Each task re-opens the PDF, so very small
+# chunks waste time on parsing the document structure again.
+PAGES_PER_TASK = 4
+DEFAULT_WORKERS = max(1, min(8, (os.cpu_count() or 1)))
+# Chunks submitted ahead of the consumer when iterating lazily
+PREFETCH_TASKS = DEFAULT_WORKERS * 2
+
+# PDFs are passed around either as bytes or as the path of a spooled file.
+# Paths keep large documents out of pool task arguments and off the heap.
+PdfSource = Union[bytes, str]
+
+METRIC_KEYWORDS = (
+    "click", "impression", "cost", "conversion", "conv.", "ctr", "cpc", "cpa",
+    "roas", "revenue", "value", "spend", "transactions", "sessions", "orders",
+)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PAGE RELEVANCE
+# ═══════════════════════════════════════════════════════════════════════════════
+
+KEYWORD_PATTERN = re.compile("|".join(re.escape(k) for k in METRIC_KEYWORDS), re.IGNORECASE)
+CURRENCY_PATTERN = re.compile(r"[£$€]\s?\d")
+PERCENT_PATTERN = re.compile(r"\d\s?%")
+# Added to the word count so near-empty pages cannot outrank real summary pages
+RELEVANCE_SMOOTHING = 20
+
+def score_page_text(text: Optional[str]) -> float:
+    """Metric relevance of a page: weighted density of metric keywords,
+    currency amounts, percentages and numeric tokens per word"""
+    if not text:
+        return 0.0
+    words = text.split()
+    numbers = sum(1 for word in words if any(ch.isdigit() for ch in word))
+    weighted = (
+        2.0 * len(KEYWORD_PATTERN.findall(text))
+        + 1.5 * len(CURRENCY_PATTERN.findall(text))
+        + 1.5 * len(PERCENT_PATTERN.findall(text))
+        + numbers
+    )
+    return weighted / (len(words) + RELEVANCE_SMOOTHING)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PAGE EXTRACTION
+# ═══════════════════════════════════════════════════════════════════════════════
+
+@contextmanager
+def open_pdf(pdf_source: PdfSource) -> Iterator[pdfplumber.PDF]:
+    """Open a PDF from bytes, or memory-map it from a file path"""
+    if isinstance(pdf_source, (bytes, bytearray)):
+        with pdfplumber.open(io.BytesIO(pdf_source)) as pdf:
+            yield pdf
+        return
+
+    with open(pdf_source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with pdfplumber.open(mapped) as pdf:
+            yield pdf
+
+def current_rss() -> int:
+    """Resident memory of this process in bytes, or 0 when unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        # Peak rather than current, in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+    return 0
+
+def count_pages(pdf_source: PdfSource) -> int:
+    """Return the number of pages in a PDF"""
+    with open_pdf(pdf_source) as pdf:
+        return len(pdf.pages)
+
+def iter_page_range(pdf_source: PdfSource, page_indexes: List[int]) -> Iterator[Dict[str, Any]]:
+    """Yield text for the given zero-based page indexes, timing each page.
+
+    Never raises for a single bad page - the error is returned with that page
+    instead, so callers can turn it into a warning. Each page's layout caches
+    are released as soon as its text is read, so memory stays flat however
+    long the document is. The process RSS is sampled after every page, and
+    each page is scored for metric relevance while still in the worker.
+    """
+    with open_pdf(pdf_source) as pdf:
+        for index in page_indexes:
+            start = time.perf_counter()
+            text, error = None, None
+            page = pdf.pages[index]
+            try:
+                text = page.extract_text()
+            except Exception as e:
+                error = str(e)
+            finally:
+                page.close()
+            yield {
+                "page": index + 1,
+                "text": text,
+                "error": error,
+                "seconds": time.perf_counter() - start,
+                "rss": current_rss(),
+                "pid": os.getpid(),
+                "score": score_page_text(text),
+            }
+
+def extract_page_range(pdf_source: PdfSource, page_indexes: List[int]) -> List[Dict[str, Any]]:
+    """Pool worker entry point - only takes and returns picklable values"""
+    return list(iter_page_range(pdf_source, page_indexes))
+
+def chunk_page_indexes(page_count: int, chunk_size: int = PAGES_PER_TASK, start_page: int = 0) -> List[List[int]]:
+    """Split page indexes into contiguous chunks"""
+    return [list(range(i, min(i + chunk_size, page_count))) for i in range(start_page, page_count, chunk_size)]
+
+def iter_pages(pdf_source: PdfSource, executor: Optional[Executor] = None, start_page: int = 0) -> Iterator[Dict[str, Any]]:
+    """Lazily yield extracted pages in page order, starting at start_page.
+
+    Nothing is parsed until the caller asks for the next page, so a consumer
+    that stops early never pays for the rest of the document. With an executor
+    only a small window of chunks is submitted ahead of the consumer, and
+    chunks still pending when the generator is closed are cancelled.
+    """
+    page_count = count_pages(pdf_source)
+    if executor is None or page_count - start_page <= PAGES_PER_TASK:
+        yield from iter_page_range(pdf_source, list(range(start_page, page_count)))
+        return
+
+    chunks = deque(chunk_page_indexes(page_count, start_page=start_page))
+    pending = deque()
+    try:
+        while chunks or pending:
+            while chunks and len(pending) < PREFETCH_TASKS:
+                pending.append(executor.submit(extract_page_range, pdf_source, chunks.popleft()))
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+def extract_pages(pdf_source: PdfSource, executor: Optional[Executor] = None) -> List[Dict[str, Any]]:
+    """Extract every page, optionally spreading chunks across an executor"""
+    return list(iter_pages(pdf_source, executor))
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# METRIC TABLES
+# ═══════════════════════════════════════════════════════════════════════════════
+
+# Pages scanned for metric tables - summary tables sit near the front of a report
+TABLE_SCAN_PAGES = 10
+
+PERIOD_PATTERNS = (
+    (re.compile(r"month\s+on\s+month|\bmom\b|previous\s+month|last\s+month", re.IGNORECASE), "Month on Month"),
+    (re.compile(r"year\s+on\s+year|\byoy\b|previous\s+year|last\s+year", re.IGNORECASE), "Year on Year"),
+)
+# A change cell must carry a %, so a previous-period value is never read as one
+CHANGE_PATTERN = re.compile(r"^([+\-−]?)\s*(\d+(?:[.,]\d+)*)\s*%$")
+# Header text marking the change column of a metric-per-row table
+CHANGE_HEADER_PATTERN = re.compile(r"change|%|\bvs\b|diff|\+/-|Δ", re.IGNORECASE)
+
+def clean_cell(cell: Optional[str]) -> str:
+    """Collapse whitespace in a table cell"""
+    return " ".join(str(cell).split()) if cell is not None else ""
+
+def is_metric_name(name: str) -> bool:
+    """Whether a cell looks like an advertising metric name"""
+    lowered = name.lower()
+    return any(keyword in lowered for keyword in METRIC_KEYWORDS)
+
+def parse_change_cell(cell: str) -> Optional[float]:
+    """Parse a change cell such as '+11.3%' or '-66.6 %' into a number"""
+    match = CHANGE_PATTERN.match(cell.replace(" ", ""))
+    if not match:
+        return None
+    sign, number = match.groups()
+    value = float(number.replace(",", ""))
+    return -value if sign in ("-", "−") else value
+
+def find_period(text: str) -> Optional[str]:
+    """Return the last comparison period mentioned in text"""
+    found, position = None, -1
+    for pattern, period in PERIOD_PATTERNS:
+        for match in pattern.finditer(text):
+            if match.start() > position:
+                found, position = period, match.start()
+    return found
+
+def find_change_column(header: List[str]) -> Optional[int]:
+    """Index of the change column named in a metric-per-row header, if any"""
+    for index, cell in enumerate(header[2:], 2):
+        if CHANGE_HEADER_PATTERN.search(cell):
+            return index
+    return None
+
+def rows_from_table(table: List[List[str]], period: Optional[str]) -> List[Dict[str, Any]]:
+    """Read metric rows from a table laid out either as metric/value/change
+    rows or as one column per metric with value and change rows beneath"""
+    rows = []
+    header = [cell.lower() for cell in table[0]]
+
+    if len(header) >= 2 and ("metric" in header[0] or not is_metric_name(header[1])):
+        # One metric per row: name, value, then a change column found by its
+        # header. Tables without a header row start with data straight away
+        # and get no change, leaving them low-confidence.
+        has_header = not is_metric_name(table[0][0])
+        body = table[1:] if has_header else table
+        change_column = find_change_column(header) if has_header else None
+        for cells in body:
+            if len(cells) < 2 or not is_metric_name(cells[0]) or not cells[1]:
+                continue
+            has_change = change_column is not None and len(cells) > change_column
+            change = parse_change_cell(cells[change_column]) if has_change else None
+            rows.append({"Metric": cells[0], "Value": cells[1].replace(",", ""), "Change (%)": change, "Period": period})
+    elif len(table) >= 2:
+        # One metric per column: header of names, then a value row and optional change row
+        values = table[1]
+        changes = table[2] if len(table) > 2 else [""] * len(values)
+        for name, value, change in zip(table[0], values, changes):
+            if not is_metric_name(name) or not value:
+                continue
+            rows.append({"Metric": name, "Value": value.replace(",", ""), "Change (%)": parse_change_cell(change), "Period": period})
+
+    return rows
+
+def extract_table_metrics(pdf_source: PdfSource, max_pages: int = TABLE_SCAN_PAGES) -> Tuple[List[Dict[str, Any]], float]:
+    """Read Metric/Value/Change (%)/Period rows from the PDF's tables.
+
+    Returns the rows and a confidence between 0 and 1: the share of rows that
+    have a known period and a parsable change. The period of a table is taken
+    from its own header, or failing that from the nearest heading above it.
+    """
+    rows = []
+    with open_pdf(pdf_source) as pdf:
+        for page in pdf.pages[:max_pages]:
+            try:
+                tables = page.find_tables()
+                for table in tables:
+                    cells = [[clean_cell(cell) for cell in row] for row in table.extract()]
+                    cells = [row for row in cells if any(row)]
+                    if len(cells) < 2:
+                        continue
+                    above = page.crop((0, 0, page.width, table.bbox[1])).extract_text() or ""
+                    period = find_period(" ".join(cells[0])) or find_period(above)
+                    rows.extend(rows_from_table(cells, period))
+            except Exception:
+                continue
+            finally:
+                page.close()
+
+    if not rows:
+        return [], 0.0
+
+    confident = sum(1 for row in rows if row["Period"] and row["Change (%)"] is not None)
+    return rows, confident / len(rows)
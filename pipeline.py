@@ -0,0 +1,286 @@
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import Executor
+from typing import Optional, Dict, Any, List, Callable, Hashable
+
+import pandas as pd
+
+from banned_words import BannedWordMatcher, BannedWordStats, split_paragraphs, flag_paragraphs
+from metric_schema import METRIC_COLUMNS, METRICS_RESPONSE_FORMAT
+from pdf_extraction import iter_pages, PdfSource
+from prompts import Messages, render_prompt, template_versions
+from result_store import ResultStore, DEFAULT_STORE_DIR
+from token_budget import count_message_tokens, count_tokens, truncate_to_tokens, plan_stage_budget
+
+OPENAI_MODEL = "gpt-4o"
+# Model used for each stage. Extraction defaults to the smaller, faster model
+# and re-asks FALLBACK_MODEL when its output cannot be parsed.
+STAGE_MODELS = {
+    "extraction": os.environ.get("EXTRACTION_MODEL", "gpt-4o-mini"),
+    "analysis": os.environ.get("ANALYSIS_MODEL", OPENAI_MODEL),
+    "refinement": os.environ.get("REFINEMENT_MODEL", OPENAI_MODEL),
+    "rewrite": os.environ.get("REWRITE_MODEL", OPENAI_MODEL),
+}
+FALLBACK_MODEL = OPENAI_MODEL
+
+# Prompts are sized in tokens: each stage gets input and output caps derived
+# from its latency and cost targets in token_budget.STAGE_TARGETS. PDF pages
+# beyond what fills the extraction prompt are only parsed when something needs
+# the full text. The prompt is filled with the most metric-dense pages, so at
+# least this many pages are scored before the budget is allowed to stop parsing.
+RELEVANCE_SCAN_PAGES = 12
+
+# Metrics read straight from PDF tables skip the LLM extraction call when at
+# least this many rows are found and this share of them are complete.
+TABLE_MIN_METRICS = 3
+TABLE_MIN_CONFIDENCE = 0.8
+
+# Paragraphs of a generated analysis that use prompts.BANNED_WORDS are
+# rewritten up to this many times each
+BANNED_WORD_REWRITE_ATTEMPTS = 2
+
+# Saved results per report, shared by the app and bulk.py. Bump the schema when
+# the stored format changes - prompt template and model changes invalidate
+# entries automatically.
+RESULT_STORE_DIR = os.environ.get("RESULT_STORE_DIR", DEFAULT_STORE_DIR)
+RESULT_STORE_MAX_MB = 200
+RESULT_STORE_SCHEMA = 1
+
+# Typed columns every metrics frame gets at ingest, so rendering, export and
+# comparisons work on numbers instead of re-parsing the Value and Change (%)
+# strings. Amount is the value at full scale, e.g. 173250.0 for "173.25K";
+# Unit is the currency symbol or "%" and Scale the K/M/B suffix, if any.
+AMOUNT_COLUMN = "Amount"
+UNIT_COLUMN = "Unit"
+SCALE_COLUMN = "Scale"
+CHANGE_COLUMN = "Change"
+TYPED_COLUMNS = [AMOUNT_COLUMN, UNIT_COLUMN, SCALE_COLUMN, CHANGE_COLUMN]
+SCALE_FACTORS = {"K": 1e3, "M": 1e6, "B": 1e9}
+# Optional sign and currency, digits with thousands separators, then an
+# optional scale suffix or percent sign. Anchored, with no nested repetition.
+VALUE_PATTERN = (
+    r"^\s*(?P<sign>[-+])?\s*(?P<currency>[£$€])?\s*(?P<currency_sign>[-+])?"
+    r"(?P<number>\d[\d,]*(?:\.\d*)?|\.\d+)\s*(?P<scale>[KkMmBb])?\s*(?P<percent>%)?\s*$"
+)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# STAGE ROUTING
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def stage_models(stage: str) -> List[str]:
+    """Models tried for a stage, in order: the routed model, then the fallback"""
+    model = STAGE_MODELS.get(stage, OPENAI_MODEL)
+    return [model] if model == FALLBACK_MODEL else [model, FALLBACK_MODEL]
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# REPORT TEXT
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def format_page_text(page: Dict[str, Any]) -> str:
+    """Format an extracted page the way it appears in the prompt text"""
+    if page["error"] is not None or not page["text"] or not page["text"].strip():
+        return ""
+    return f"\n--- Page {page['page']} ---\n{page['text']}\n"
+
+def count_page_tokens(page: Dict[str, Any]) -> int:
+    """Store and return the prompt tokens an extracted page takes up"""
+    page["tokens"] = count_tokens(format_page_text(page), stage_models("extraction")[0])
+    return page["tokens"]
+
+def select_relevant_pages(pages: List[Dict[str, Any]], token_budget: int) -> List[Dict[str, Any]]:
+    """Fill token_budget with the highest-scoring pages, returned in page order"""
+    readable = [page for page in pages if page["tokens"]]
+    selected, used = [], 0
+    for page in sorted(readable, key=lambda p: p["score"], reverse=True):
+        if not selected or used + page["tokens"] <= token_budget:
+            selected.append(page)
+            used += page["tokens"]
+    return sorted(selected, key=lambda p: p["page"])
+
+def join_page_texts(pages: List[Dict[str, Any]]) -> str:
+    """Prompt text for a set of pages, or "" when none has readable text"""
+    return "".join(format_page_text(page) for page in pages).strip()
+
+def read_report_text(pdf_source: PdfSource, token_budget: int, executor: Optional[Executor] = None) -> str:
+    """Text of the most metric-dense pages that fit in token_budget, reading
+    no further than needed to choose them"""
+    pages, tokens = [], 0
+    page_iter = iter_pages(pdf_source, executor)
+    try:
+        for page in page_iter:
+            pages.append(page)
+            tokens += count_page_tokens(page)
+            if tokens >= token_budget and len(pages) >= RELEVANCE_SCAN_PAGES:
+                break
+    finally:
+        page_iter.close()
+    return join_page_texts(select_relevant_pages(pages, token_budget))
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PROMPTS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def prompt_text_budget(build_prompt, stage: str) -> int:
+    """Tokens of report text build_prompt can take within the stage's input cap.
+
+    The same prompt may be re-sent to the fallback model, so it has to fit
+    the tightest cap of every model the stage can use.
+    """
+    budgets = []
+    for model in stage_models(stage):
+        overhead = count_message_tokens(build_prompt(""), model)
+        budgets.append(plan_stage_budget(stage, model)["input_tokens"] - overhead)
+    return max(min(budgets), 0)
+
+def fit_prompt(build_prompt, text: str, stage: str) -> Messages:
+    """Build a prompt with as much of text as the stage's input cap allows"""
+    return build_prompt(truncate_to_tokens(text, prompt_text_budget(build_prompt, stage), stage_models(stage)[0]))
+
+def get_safer_extraction_prompt(raw_text: str) -> Messages:
+    """Generate extraction prompt"""
+    return render_prompt("extraction", raw_text=raw_text)
+
+def get_schema_extraction_prompt(raw_text: str) -> Messages:
+    """Generate the extraction prompt for replies constrained to METRICS_RESPONSE_FORMAT"""
+    return render_prompt("schema_extraction", raw_text=raw_text)
+
+def get_simple_extraction_prompt(raw_text: str) -> Messages:
+    """Generate the fallback extraction prompt"""
+    return render_prompt("simple_extraction", raw_text=raw_text)
+
+def prompt_metrics_text(df: pd.DataFrame) -> str:
+    """Metrics as they appear in prompts - the extracted columns only"""
+    return df.drop(columns=TYPED_COLUMNS, errors="ignore").to_string(index=False)
+
+def get_analysis_prompt(df: pd.DataFrame) -> Messages:
+    """Generate analysis prompt"""
+    return render_prompt("analysis", metrics=prompt_metrics_text(df))
+
+def get_refinement_prompt(df: pd.DataFrame, analysis: str, request: str) -> Messages:
+    """Generate the prompt refining analysis with the user's request"""
+    return render_prompt("refinement", metrics=prompt_metrics_text(df), analysis=analysis, request=request)
+
+def get_rewrite_prompt(paragraph: str, words: List[str]) -> Messages:
+    """Generate the prompt rewriting one paragraph without the banned words it used"""
+    return render_prompt("rewrite", paragraph=paragraph, words=", ".join(words))
+
+def extraction_format(schema: bool) -> Optional[Dict[str, Any]]:
+    """response_format for extraction calls"""
+    return METRICS_RESPONSE_FORMAT if schema else None
+
+def extraction_prompt(schema: bool) -> Callable[[str], Messages]:
+    """Extraction prompt builder showing the reply shape extraction_format(schema) asks for"""
+    return get_schema_extraction_prompt if schema else get_safer_extraction_prompt
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# BANNED WORDS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def rewrite_banned_paragraphs(analyses: Dict[Hashable, str], matcher: BannedWordMatcher,
+                              rewrite: Callable[[Dict[Any, Messages]], Dict[Any, Optional[str]]],
+                              stats: Optional[BannedWordStats] = None) -> Dict[Hashable, str]:
+    """analyses with only the paragraphs that use banned words rewritten.
+
+    rewrite is given the rewrite prompt for every flagged paragraph, keyed by
+    (analysis key, paragraph index), and returns the replies by the same keys,
+    so the app can send them concurrently and bulk.py as one batch. Paragraphs
+    still using a banned word after BANNED_WORD_REWRITE_ATTEMPTS rewrites, or
+    whose rewrite failed, are kept as they are.
+    """
+    parts = {key: split_paragraphs(text) for key, text in analyses.items()}
+    flagged = {key: flag_paragraphs(matcher, paragraphs) for key, paragraphs in parts.items()}
+    if stats is not None:
+        for hits in flagged.values():
+            stats.record_scan(sum(hits.values(), Counter()))
+    flagged = {key: hits for key, hits in flagged.items() if hits}
+    if not flagged:
+        return analyses
+
+    start = time.perf_counter()
+    rewritten = {key: set() for key in flagged}
+    remaining = flagged
+    for _ in range(BANNED_WORD_REWRITE_ATTEMPTS):
+        prompts = {
+            (key, index): get_rewrite_prompt(parts[key][index], sorted(hits))
+            for key, paragraphs in remaining.items() for index, hits in paragraphs.items()
+        }
+        for (key, index), reply in rewrite(prompts).items():
+            if reply and reply.strip():
+                parts[key][index] = reply.strip()
+                rewritten[key].add(index)
+        remaining = {key: flag_paragraphs(matcher, parts[key], paragraphs) for key, paragraphs in remaining.items()}
+        remaining = {key: paragraphs for key, paragraphs in remaining.items() if paragraphs}
+        if not remaining:
+            break
+
+    if stats is not None:
+        seconds = time.perf_counter() - start
+        for key in flagged:
+            left_in = sum(sum(hits.values()) for hits in remaining.get(key, {}).values())
+            stats.record_rewrite(len(rewritten[key]), left_in, seconds)
+    return {key: "".join(paragraphs) for key, paragraphs in parts.items()}
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# METRIC FRAMES
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def type_metrics(df: pd.DataFrame) -> pd.DataFrame:
+    """df with TYPED_COLUMNS parsed from Value and Change (%) in one vectorized
+    pass. Values that are not a plain number, e.g. "N/A", get no Amount."""
+    typed = df.drop(columns=TYPED_COLUMNS, errors="ignore")
+    # Missing columns are read as empty but not added, so a reply without
+    # Period is still shown as a plain table
+    missing = pd.Series(None, index=typed.index, dtype=object)
+
+    parts = typed.get("Value", missing).astype("string").str.extract(VALUE_PATTERN)
+    sign = parts["sign"].fillna(parts["currency_sign"]).map({"-": -1.0}).fillna(1.0).astype(float)
+    scale = parts["scale"].str.upper()
+    number = pd.to_numeric(parts["number"].str.replace(",", "", regex=False), errors="coerce").astype(float)
+    typed[AMOUNT_COLUMN] = sign * number * scale.map(SCALE_FACTORS).fillna(1.0).astype(float)
+    unit = parts["currency"].fillna(parts["percent"])
+    typed[UNIT_COLUMN] = unit.astype(object).where(unit.notna(), None)
+    typed[SCALE_COLUMN] = scale.astype(object).where(scale.notna(), None)
+
+    # Schema replies give Change (%) as a number, repaired ones sometimes as "+12.5%"
+    change = typed.get("Change (%)", missing).astype("string").str.replace(r"[%+,\s]", "", regex=True)
+    typed[CHANGE_COLUMN] = pd.to_numeric(change, errors="coerce").astype(float)
+    return typed
+
+def metrics_frame(rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Typed metrics frame from extracted rows"""
+    return type_metrics(pd.DataFrame(rows, columns=METRIC_COLUMNS))
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# RESULTS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def table_metrics_frame(rows: List[Dict[str, Any]], confidence: float) -> Optional[pd.DataFrame]:
+    """Metrics read from PDF tables, or None when too few or too uncertain to
+    skip the LLM extraction call"""
+    if len(rows) < TABLE_MIN_METRICS or confidence < TABLE_MIN_CONFIDENCE:
+        return None
+    df = metrics_frame(rows)
+    return df[df["Period"].notna()].reset_index(drop=True)
+
+def result_key(content: str, chunked: bool, schema: bool) -> str:
+    """Result store key for a report's content_key and the extraction mode its
+    metrics come from, so switching mode extracts again instead of reloading"""
+    return f"{content}-{'whole' if chunked else 'relevant'}-{'schema' if schema else 'json'}"
+
+def open_result_store() -> ResultStore:
+    """Result store at RESULT_STORE_DIR under the current schema"""
+    return ResultStore(
+        directory=RESULT_STORE_DIR,
+        max_bytes=RESULT_STORE_MAX_MB * 1024 * 1024,
+        schema_version=result_store_schema()
+    )
+
+def result_store_schema() -> str:
+    """Result store schema version, covering the prompt templates and stage models"""
+    fingerprint = hashlib.md5(
+        json.dumps({"templates": template_versions(), "models": STAGE_MODELS}, sort_keys=True).encode()
+    ).hexdigest()[:12]
+    return f"{RESULT_STORE_SCHEMA}-{fingerprint}"
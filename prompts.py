@@ -0,0 +1,155 @@
+import textwrap
+from typing import Dict, List
+
+Messages = List[Dict[str, str]]
+
+BANNED_WORDS = (
+    "Everest", "Matterhorn", "levate", "juncture", "moreover", "landscape", "utilise", "maze", "labyrinth", "cusp",
+    "hurdles", "bustling", "harnessing", "unveiling the power", "realm", "depicted", "demystify", "insurmountable",
+    "new era", "poised", "unravel", "entanglement", "unprecedented", "eerie connection", "unliving", "beacon",
+    "unleash", "delve", "enrich", "multifaceted", "elevate", "discover", "supercharge", "unlock", "tailored",
+    "elegant", "dive", "ever-evolving", "pride", "meticulously", "grappling", "superior", "weighing", "merely",
+    "picture", "architect", "adventure", "journey", "embark", "navigate", "navigation", "navigating", "enchanting",
+    "world", "dazzle", "tapestry", "in this blog", "in this article", "dive-in", "in today's", "right place",
+    "let's get started", "imagine this", "picture this", "consider this", "just explore",
+)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PROMPT TEMPLATES
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class PromptTemplate:
+    """A prompt laid out as a fixed prefix followed by per-call content.
+
+    system and instructions are identical on every call, so they form a
+    prefix the provider can cache. content is the only part filled in per
+    call and always comes last, ordered from the most to the least stable
+    field. Bump version whenever any of the wording changes.
+    """
+
+    def __init__(self, name: str, version: int, system: str, instructions: str, content: str):
+        self.name = name
+        self.version = version
+        self.system = system
+        self.instructions = instructions
+        self.content = content
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+    def render(self, **fields: str) -> Messages:
+        """Chat messages for this template with its content fields filled in"""
+        return [
+            {"role": "system", "content": f"{self.system}\n\n{self.instructions}"},
+            {"role": "user", "content": self.content.format(**fields)},
+        ]
+
+EXTRACTION_SYSTEM = "You are a data extraction assistant specialized in parsing advertising reports."
+
+EXTRACTION_RULES = """Extract key performance metrics from the Google Ads report text you are given and return as valid JSON.
+
+CRITICAL JSON RULES:
+1. Use ONLY double quotes, never single quotes
+2. Escape any quotes in string values with backslash
+3. Use null (not "null") for missing values
+4. Keep numbers as numbers, not strings for Change (%)
+5. Remove % symbol from Change (%) values - just use the number
+6. Be extra careful with product names containing quotes or special characters"""
+
+EXTRACTION_EXAMPLE_ROWS = """{"Metric": "Clicks", "Value": "2025", "Change (%)": 11.3, "Period": "Month on Month"},
+{"Metric": "Impressions", "Value": "173.25K", "Change (%)": 33.9, "Period": "Month on Month"},
+{"Metric": "Cost", "Value": "£1564.51", "Change (%)": 22.4, "Period": "Month on Month"},
+{"Metric": "Conversions", "Value": "8.75", "Change (%)": -66.6, "Period": "Month on Month"},
+{"Metric": "CTR", "Value": "1.17%", "Change (%)": -16.9, "Period": "Month on Month"},
+{"Metric": "Average CPC", "Value": "£0.77", "Change (%)": 10.0, "Period": "Month on Month"},
+{"Metric": "Cost per Conversion", "Value": "£178.73", "Change (%)": 266.8, "Period": "Month on Month"},
+{"Metric": "Conversion Rate", "Value": "0.2%", "Change (%)": -81.9, "Period": "Month on Month"}"""
+
+EXTRACTION_INSTRUCTIONS = f"""{EXTRACTION_RULES}
+
+Return EXACTLY this format:
+[
+{textwrap.indent(EXTRACTION_EXAMPLE_ROWS, "  ")}
+]
+
+Reply with JSON only."""
+
+# Used when the reply is constrained to metric_schema.METRICS_RESPONSE_FORMAT,
+# which needs the rows wrapped in an object
+SCHEMA_EXTRACTION_INSTRUCTIONS = f"""{EXTRACTION_RULES}
+
+Return EXACTLY this format:
+{{
+  "metrics": [
+{textwrap.indent(EXTRACTION_EXAMPLE_ROWS, "    ")}
+  ]
+}}
+
+Reply with JSON only."""
+
+SIMPLE_EXTRACTION_INSTRUCTIONS = """Extract metrics from the Google Ads report text you are given as simple JSON.
+Format: [{"Metric": "Clicks", "Value": "2025", "Change (%)": 11.3, "Period": "Month on Month"}]"""
+
+# Shared by analysis and refinement so both start with the same prefix
+ANALYST_SYSTEM = f"""You are an online paid advertising expert who manages ad campaigns on behalf of your client.
+
+Write in a personal style. Ensure the tone of voice is friendly but not informal.
+
+Write in the present perfect tense, for example rather than "The number of clicks has increased by 6.4%" say "We've seen a significant increase in traffic, with clicks up by 6.4%".
+
+Overall we want the analysis to make it seem as though it's 'our' account. This is because when we talk about it, it's our work so the responsibility and performance is on our shoulders.
+
+Keep the tone professional but approachable, without excessive formality or technical jargon.
+
+Ensure all content is written in UK English(e.g., humanise instead of humanize, colour instead of color) and does not include greetings or sign-offs.
+
+Do not use emojis or exclamation marks.
+
+You MUST NOT include any of the following words in the response:
+{", ".join(BANNED_WORDS)}"""
+
+ANALYSIS_INSTRUCTIONS = """Generate a comprehensive summary report for your client's PPC account from the metrics table you are given.
+
+Analyse both Month on Month and Year on Year performance where available. Include Shopify data if present.
+Identify key trends and provide insights. Expand on any performance trends and insights.
+
+Structure your analysis as follows:
+1. **Traffic & Cost** - Analyse clicks, impressions, CPC, and total cost trends
+2. **Engagement** - Review CTR, search impression share, and engagement metrics
+3. **Conversions** - Examine conversion rates, conversion values, ROAS, and revenue metrics
+4. **Year on Year Comparison** - Compare current performance to the same period last year (if data available)
+5. **Key Takeaways & Next Steps** - Provide actionable recommendations"""
+
+REFINEMENT_INSTRUCTIONS = """The user provided additional instructions to refine an analysis of your client's PPC account.
+You are given the metrics table, the original analysis and the user's request.
+
+Provide an improved analysis based on this feedback. Keep the same professional tone and UK English style."""
+
+REWRITE_INSTRUCTIONS = """One paragraph of an analysis of your client's PPC account used words you must not use.
+You are given the paragraph and the words it used.
+
+Rewrite the paragraph without those words or any other word you must not use. Keep every figure, the meaning, the markdown formatting and about the same length.
+Reply with the rewritten paragraph only."""
+
+PROMPT_TEMPLATES = {
+    template.name: template for template in (
+        PromptTemplate("extraction", 1, EXTRACTION_SYSTEM, EXTRACTION_INSTRUCTIONS, "Text to analyze:\n{raw_text}"),
+        PromptTemplate("schema_extraction", 1, EXTRACTION_SYSTEM, SCHEMA_EXTRACTION_INSTRUCTIONS, "Text to analyze:\n{raw_text}"),
+        PromptTemplate("simple_extraction", 1, EXTRACTION_SYSTEM, SIMPLE_EXTRACTION_INSTRUCTIONS, "{raw_text}"),
+        PromptTemplate("analysis", 1, ANALYST_SYSTEM, ANALYSIS_INSTRUCTIONS, "Metrics:\n{metrics}"),
+        PromptTemplate(
+            "refinement", 1, ANALYST_SYSTEM, REFINEMENT_INSTRUCTIONS,
+            "Metrics:\n{metrics}\n\nOriginal analysis:\n{analysis}\n\nUser request:\n\"{request}\""
+        ),
+        PromptTemplate("rewrite", 1, ANALYST_SYSTEM, REWRITE_INSTRUCTIONS, "Words used: {words}\n\nParagraph:\n{paragraph}"),
+    )
+}
+
+def render_prompt(name: str, **fields: str) -> Messages:
+    """Chat messages for the registered template name"""
+    return PROMPT_TEMPLATES[name].render(**fields)
+
+def template_versions() -> Dict[str, int]:
+    """Version of every registered template, for invalidating stored results"""
+    return {name: template.version for name, template in PROMPT_TEMPLATES.items()}
@@ -0,0 +1,174 @@
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Callable
+
+import openai
+
+# Retry-After values beyond this are treated as this long
+MAX_RETRY_AFTER_SECONDS = 60
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_CAP_SECONDS = 30.0
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# SHARED RATE LIMITER
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute budget shared by every session.
+
+    Both budgets are token buckets refilled continuously at their per-minute
+    rate. Callers are served strictly in arrival order, so one large request
+    cannot be starved by a stream of small ones. A rate-limit response from
+    the provider pauses the whole limiter for its Retry-After period, rather
+    than letting each session back off on its own.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, clock: Callable[[], float] = time.monotonic):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._clock = clock
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._granted = 0
+        self._queued = 0
+        self._pauses = 0
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+        self._updated = now
+
+    def _seconds_until_free(self, tokens: int, now: float) -> float:
+        waits = [self._paused_until - now, 0.0]
+        if self._requests < 1:
+            waits.append((1 - self._requests) * 60 / self.requests_per_minute)
+        if self._tokens < tokens:
+            waits.append((tokens - self._tokens) * 60 / self.tokens_per_minute)
+        return max(waits)
+
+    def acquire(self, tokens: int, on_wait: Optional[Callable[[int, Optional[float]], None]] = None, poll: float = 1.0):
+        """Block until one request of tokens tokens fits in both budgets.
+
+        While queued, on_wait is called about every poll seconds with the
+        caller's 1-based queue position and, at the head of the queue, the
+        expected wait in seconds. Exceptions from on_wait (e.g. a Streamlit
+        rerun) abandon the place in the queue.
+        """
+        # A request larger than the whole bucket only has to wait for a full one
+        tokens = min(tokens, self.tokens_per_minute)
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+
+        try:
+            waited = False
+            while True:
+                with self._cond:
+                    now = self._clock()
+                    self._refill(now)
+                    position = self._queue.index(ticket)
+                    seconds = self._seconds_until_free(tokens, now) if position == 0 else None
+                    if seconds == 0:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        self._queue.popleft()
+                        self._granted += 1
+                        self._queued += waited
+                        self._cond.notify_all()
+                        return
+
+                waited = True
+                if on_wait is not None:
+                    on_wait(position + 1, seconds)
+                with self._cond:
+                    self._cond.wait(min(seconds, poll) if seconds is not None else poll)
+        except BaseException:
+            with self._cond:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                    self._cond.notify_all()
+            raise
+
+    def try_acquire(self, tokens: int) -> bool:
+        """Take capacity for one request only if it is free now and nobody is queued"""
+        tokens = min(tokens, self.tokens_per_minute)
+        with self._cond:
+            now = self._clock()
+            self._refill(now)
+            if self._queue or self._seconds_until_free(tokens, now) > 0:
+                return False
+            self._requests -= 1
+            self._tokens -= tokens
+            self._granted += 1
+            return True
+
+    def pause(self, seconds: float):
+        """Hold every queued and future request for seconds"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+            self._pauses += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"granted": self._granted, "queued": self._queued, "waiting": len(self._queue), "pauses": self._pauses}
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# RETRY CLASSIFICATION
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a failed call may succeed if repeated"""
+    if isinstance(error, openai.RateLimitError):
+        # An exhausted quota is reported as a 429 but never clears on its own
+        return getattr(error, "code", None) != "insufficient_quota"
+    if isinstance(error, (openai.APIConnectionError, openai.InternalServerError, openai.ConflictError)):
+        return True
+    if isinstance(error, TimeoutError):
+        # A call abandoned at its stage deadline, e.g. by latency.hedged_call
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 408 or error.status_code >= 500
+    return False
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """The provider's requested delay before retrying, if it sent one"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    seconds = None
+    try:
+        if headers.get("retry-after-ms"):
+            seconds = float(headers["retry-after-ms"]) / 1000
+        elif headers.get("retry-after"):
+            value = headers["retry-after"]
+            try:
+                seconds = float(value)
+            except ValueError:
+                seconds = parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+    if seconds is None or seconds < 0:
+        return None
+    return min(seconds, MAX_RETRY_AFTER_SECONDS)
+
+def backoff_seconds(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Delay before retry number attempt (0-based).
+
+    Honours Retry-After plus up to 20% jitter, so sessions throttled together
+    do not all retry at the same instant. Without it, uses full-jitter
+    exponential backoff.
+    """
+    if retry_after is not None:
+        return retry_after * (1 + random.uniform(0, 0.2))
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt + 1)))
@@ -0,0 +1,120 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+from typing import Optional, Dict, Any
+
+import pandas as pd
+
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".result_store")
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CONTENT-ADDRESSED RESULT STORE
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def content_key(file_bytes: bytes) -> str:
+    """Key for an uploaded file, derived from its content only"""
+    return hashlib.sha256(file_bytes).hexdigest()
+
+def file_content_key(fileobj, chunk_size: int = 1024 * 1024) -> str:
+    """content_key for a file object, hashed in chunks without copying it"""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+class ResultStore:
+    """On-disk store of per-report results keyed by file content.
+
+    Each entry is one JSON file holding the extracted text, the metrics
+    DataFrame and the first analysis. Entries written under a different
+    schema version are treated as misses and removed. File modification times
+    track recency: reads touch the entry and writes evict the least recently
+    used entries once the store grows past max_bytes. Writes go through a temp
+    file and os.replace, so concurrent processes never see partial entries.
+    """
+
+    def __init__(self, directory: str = DEFAULT_STORE_DIR, max_bytes: int = DEFAULT_MAX_BYTES, schema_version: str = "1"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.schema_version = schema_version
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the stored entry for key, or None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get("schema_version") != self.schema_version:
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        if entry.get("metrics") is not None:
+            entry["metrics"] = pd.read_json(io.StringIO(entry["metrics"]), orient="split", dtype=False)
+        return entry
+
+    def put(self, key: str, raw_text: Optional[str] = None, metrics: Optional[pd.DataFrame] = None, analysis: Optional[str] = None):
+        """Store results for key, keeping any fields already stored and not given here"""
+        existing = self.get(key) or {}
+        entry = {
+            "schema_version": self.schema_version,
+            "created": existing.get("created", time.time()),
+            "raw_text": raw_text if raw_text is not None else existing.get("raw_text"),
+            "metrics": metrics if metrics is not None else existing.get("metrics"),
+            "analysis": analysis if analysis is not None else existing.get("analysis"),
+        }
+        if entry["metrics"] is not None:
+            entry["metrics"] = entry["metrics"].to_json(orient="split", index=False)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            self._remove(tmp_path)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the store fits in max_bytes"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(os.path.join(self.directory, name))
+            total -= size
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,213 @@
+import logging
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Optional, Dict, Any, List
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Used when no tokenizer is available for the model
+CHARS_PER_TOKEN = 4
+
+# Rough latency and price profile per model: time to first token, output
+# tokens per second, USD per million input/output tokens and context window.
+MODEL_PROFILES = {
+    "gpt-4o": {"first_token_seconds": 0.6, "output_tokens_per_second": 80, "input_usd_per_m": 2.5, "output_usd_per_m": 10.0, "context_tokens": 128000},
+    "gpt-4o-mini": {"first_token_seconds": 0.4, "output_tokens_per_second": 120, "input_usd_per_m": 0.15, "output_usd_per_m": 0.6, "context_tokens": 128000},
+}
+DEFAULT_MODEL_PROFILE = MODEL_PROFILES["gpt-4o"]
+# Share of the input price charged for prompt tokens served from the provider's cache
+CACHED_INPUT_PRICE_RATIO = 0.5
+
+# Latency and cost targets for one call of each stage
+STAGE_TARGETS = {
+    "extraction": {"target_seconds": 20, "max_usd": 0.025},
+    "analysis": {"target_seconds": 45, "max_usd": 0.05},
+    "refinement": {"target_seconds": 45, "max_usd": 0.06},
+    "rewrite": {"target_seconds": 15, "max_usd": 0.02},
+    "default": {"target_seconds": 45, "max_usd": 0.06},
+}
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# TOKEN COUNTING
+# ═══════════════════════════════════════════════════════════════════════════════
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """Tokenizer for a model, or None when tiktoken or its data is unavailable"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        try:
+            return tiktoken.get_encoding("o200k_base")
+        except Exception:
+            return None
+    except Exception:
+        # tiktoken downloads encodings on first use, which fails offline
+        logger.warning("Tokenizer for %s unavailable, estimating tokens from characters", model)
+        return None
+
+def count_tokens(text: str, model: str) -> int:
+    """Number of tokens text takes up for model"""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def count_message_tokens(messages: List[Dict[str, str]], model: str) -> int:
+    """Prompt tokens a chat request takes, including per-message framing"""
+    # Each message is wrapped in a few role/separator tokens and the reply is primed with three more
+    return sum(count_tokens(message["content"], model) + 4 for message in messages) + 3
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str) -> str:
+    """Cut text to at most max_tokens tokens"""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+def split_to_tokens(text: str, max_tokens: int, model: str) -> List[str]:
+    """Split text into consecutive pieces of at most max_tokens tokens"""
+    encoding = get_encoding(model)
+    if encoding is None:
+        size = max_tokens * CHARS_PER_TOKEN
+        return [text[i:i + size] for i in range(0, len(text), size)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# STAGE BUDGETS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def plan_stage_budget(stage: str, model: str) -> Dict[str, int]:
+    """Input and output token caps that keep one call within the stage's targets.
+
+    Output tokens are generated serially, so the latency target sets the
+    output cap. Whatever the cost target leaves after paying for that output
+    becomes the input cap.
+    """
+    profile = MODEL_PROFILES.get(model, DEFAULT_MODEL_PROFILE)
+    targets = STAGE_TARGETS.get(stage, STAGE_TARGETS["default"])
+
+    generation_seconds = max(targets["target_seconds"] - profile["first_token_seconds"], 1)
+    output_tokens = int(generation_seconds * profile["output_tokens_per_second"])
+    output_usd = output_tokens * profile["output_usd_per_m"] / 1_000_000
+    input_tokens = int(max(targets["max_usd"] - output_usd, 0) * 1_000_000 / profile["input_usd_per_m"])
+    input_tokens = min(input_tokens, profile["context_tokens"] - output_tokens)
+
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens}
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """USD cost of a call at the model's list prices"""
+    profile = MODEL_PROFILES.get(model, DEFAULT_MODEL_PROFILE)
+    input_tokens = prompt_tokens - cached_tokens + cached_tokens * CACHED_INPUT_PRICE_RATIO
+    return (input_tokens * profile["input_usd_per_m"] + completion_tokens * profile["output_usd_per_m"]) / 1_000_000
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# USAGE LOG
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class UsageLog:
+    """Per-call estimated and actual token usage, safe to share between threads.
+
+    Keeps the most recent calls in full, plus running totals per stage and
+    model and how often a model's output, fresh or cached, was re-routed to a
+    fallback model, for tuning which model each stage uses.
+    """
+
+    def __init__(self, max_records: int = 200):
+        self._records = deque(maxlen=max_records)
+        self._totals = {}
+        self._attempts = {}
+        self._fallbacks = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, model: str, estimated_prompt_tokens: int, max_output_tokens: int,
+               usage: Optional[Any] = None, seconds: Optional[float] = None):
+        """Log one call; usage is the response's usage object when the API returned one"""
+        entry = {
+            "time": time.strftime("%H:%M:%S"),
+            "stage": stage,
+            "model": model,
+            "estimated_prompt_tokens": estimated_prompt_tokens,
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            # Prompt tokens served from the provider's prompt cache
+            "cached_tokens": getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None),
+            "max_output_tokens": max_output_tokens,
+            "seconds": round(seconds, 2) if seconds is not None else None,
+        }
+        prompt_tokens = entry["prompt_tokens"] if entry["prompt_tokens"] is not None else estimated_prompt_tokens
+        completion_tokens = entry["completion_tokens"] or 0
+        with self._lock:
+            self._records.append(entry)
+            totals = self._totals.setdefault(
+                (stage, model), {"calls": 0, "seconds": 0.0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+            )
+            totals["calls"] += 1
+            totals["seconds"] += seconds or 0.0
+            totals["prompt_tokens"] += prompt_tokens
+            totals["cached_tokens"] += entry["cached_tokens"] or 0
+            totals["completion_tokens"] += completion_tokens
+        logger.info(
+            "%s call on %s: estimated %s prompt tokens, actual %s prompt (%s cached) + %s completion (cap %s) in %ss",
+            stage, model, estimated_prompt_tokens, entry["prompt_tokens"], entry["cached_tokens"],
+            entry["completion_tokens"], max_output_tokens, entry["seconds"]
+        )
+
+    def record_attempt(self, stage: str, model: str):
+        """Note that model's output for a stage was used, whether it came from
+        an API call or the response cache"""
+        with self._lock:
+            self._attempts[(stage, model)] = self._attempts.get((stage, model), 0) + 1
+
+    def record_fallback(self, stage: str, from_model: str, to_model: str):
+        """Note that a stage's output from from_model was unusable and to_model was asked instead"""
+        with self._lock:
+            self._fallbacks[(stage, from_model)] = self._fallbacks.get((stage, from_model), 0) + 1
+        logger.info("%s output from %s unusable, falling back to %s", stage, from_model, to_model)
+
+    def records(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._records)
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Totals per stage and model since the process started"""
+        with self._lock:
+            totals = {key: dict(value) for key, value in self._totals.items()}
+            attempts = dict(self._attempts)
+            fallbacks = dict(self._fallbacks)
+
+        empty = {"calls": 0, "seconds": 0.0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        rows = []
+        # Outputs served from the response cache have attempts but no calls
+        for stage, model in sorted(set(totals) | set(attempts) | set(fallbacks)):
+            total = totals.get((stage, model), empty)
+            calls = total["calls"]
+            tried = attempts.get((stage, model), 0)
+            fell_back = fallbacks.get((stage, model), 0)
+            rows.append({
+                "stage": stage,
+                "model": model,
+                "calls": calls,
+                "avg_seconds": round(total["seconds"] / calls, 2) if calls else None,
+                "prompt_tokens": total["prompt_tokens"],
+                "cached_share": round(total["cached_tokens"] / total["prompt_tokens"], 3) if total["prompt_tokens"] else 0.0,
+                "completion_tokens": total["completion_tokens"],
+                "est_cost_usd": round(estimate_cost(model, total["prompt_tokens"], total["completion_tokens"], total["cached_tokens"]), 4),
+                "attempts": tried,
+                "fallbacks": fell_back,
+                "fallback_rate": round(fell_back / tried, 3) if tried else None,
+            })
+        return rows